@@ -1,24 +1,109 @@
 #!/usr/bin/env python3
 
 import argparse
+import errno
+import os
 from pathlib import Path
 import shutil
 
-import numpy as np
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 import openmc.data
 
+# When shutil has to copy through user space, use larger reads and writes than
+# its default since library files are typically tens to hundreds of MB
+shutil.COPY_BUFSIZE = max(shutil.COPY_BUFSIZE, 4*1024*1024)
 
-def library_in_list(lib, lib_list):
-    """Returns whether the given nuclide library is present in the given list of libraries.
 
-    Does this by checking whether libraries have the same type and material list.
+def library_key(lib):
+    """Returns a hashable key identifying a nuclide library by its type and
+    material list, used to check whether it is already in the combined library.
     """
-    for lib_in_list in lib_list:
-        if isinstance(lib_in_list, type(lib)):
-            if lib['type'] == lib_in_list['type'] \
-               and np.array_equal(lib['materials'], lib_in_list['materials']):
-                return True
-    return False
+    return lib['type'], tuple(lib['materials'])
+
+
+def add_library(data_library, library, path):
+    """Add an entry parsed from another cross_sections.xml to a data library.
+
+    The type and materials are already known, so unlike
+    :meth:`openmc.data.DataLibrary.register_file` the HDF5 file doesn't need to
+    be opened.
+    """
+    data_library.libraries.append({
+        'path': str(path),
+        'type': library['type'],
+        'materials': library['materials']
+    })
+
+
+def copy_file(source, destination, link=False):
+    """Copy a library file, sharing or copying its data within the kernel when
+    the filesystem allows it.
+
+    If `link` is True, a hard link is made when the source and destination are
+    on the same filesystem. Otherwise, a reflink (copy-on-write clone) is tried
+    first, followed by :func:`os.copy_file_range`. If neither is supported,
+    the file is copied with :func:`shutil.copyfile`. The permission bits are
+    copied as with :func:`shutil.copy`.
+
+    Raises
+    ------
+    shutil.SameFileError
+        If `source` and `destination` are the same file
+    """
+    if os.path.exists(destination):
+        if os.path.samefile(source, destination):
+            raise shutil.SameFileError(
+                f'{source} and {destination} are the same file')
+        # Remove rather than truncate, since it may be a hard link to a file
+        # in another library
+        os.unlink(destination)
+
+    if link:
+        try:
+            os.link(source, destination)
+            return
+        except OSError as e:
+            # Only fall back to copying when a hard link can't be made, e.g.,
+            # across filesystems
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+
+    with open(source, 'rb') as fsrc, open(destination, 'xb') as fdst:
+        try:
+            if fcntl is None or not hasattr(fcntl, 'FICLONE'):
+                raise OSError(errno.EOPNOTSUPP, 'reflinks not supported')
+            fcntl.ioctl(fdst.fileno(), fcntl.FICLONE, fsrc.fileno())
+            done = True
+        except OSError:
+            done = False
+
+        if not done and hasattr(os, 'copy_file_range'):
+            size = os.fstat(fsrc.fileno()).st_size
+            copied = 0
+            try:
+                while copied < size:
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                                           size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+                done = copied == size
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                   errno.EOPNOTSUPP, errno.ENOTSUP):
+                    raise
+                # Start over if the kernel refused part way through
+                fdst.seek(0)
+                fdst.truncate()
+                fsrc.seek(0)
+
+    if not done:
+        shutil.copyfile(source, destination)
+    shutil.copymode(source, destination)
 
 
 description = """
@@ -41,6 +126,9 @@ parser.add_argument('-o', '--outputfilename', type=str, default='cross_sections.
                     help='Output filename')
 parser.add_argument('-l', '--libraries', type=Path,
                     help='List of data library .xml files to combine', nargs='+')
+parser.add_argument('--link', action='store_true',
+                    help='Hard link library files into the destination instead '
+                    'of copying them when it is on the same filesystem')
 parser.set_defaults(copy=True)
 args = parser.parse_args()
 
@@ -72,25 +160,36 @@ for i, lib_dir in enumerate(args.libraries):
 
 # Create output directory if it doesn't exist
 if copy:
-    print('Original library files will be copied into the destination folder')
+    if args.link:
+        print('Original library files will be linked into the destination folder')
+    else:
+        print('Original library files will be copied into the destination folder')
     args.destination.mkdir(parents=True, exist_ok=True)
 
 combined_library = openmc.data.DataLibrary()
 
+combined_keys = set()
+
 # Copy all of library 1 to new library
 for library in read_libraries[0].libraries:
+    combined_keys.add(library_key(library))
     source_file = Path(library['path'])
     destination_file = source_file
     if copy:
         destination_file = args.destination / source_file.name
-        shutil.copy(source_file, args.destination)
+        if destination_file.exists():
+            raise FileExistsError(f'Library file {destination_file.name} already'
+                                  ' exists in the combined library')
+        copy_file(source_file, destination_file, args.link)
     print(f'Adding {source_file.name} from {args.libraries[0].resolve()}')
-    combined_library.register_file(destination_file)
+    add_library(combined_library, library, destination_file)
 
 # For each other libraries, check library and add if not already present
 for lib_num in range(1, len(read_libraries)):
     for library in read_libraries[lib_num].libraries:
-        if not library_in_list(library, combined_library.libraries):
+        key = library_key(library)
+        if key not in combined_keys:
+            combined_keys.add(key)
             source_file = Path(library['path'])
             destination_file = source_file
             if copy:
@@ -98,9 +197,9 @@ for lib_num in range(1, len(read_libraries)):
                 if destination_file.exists():
                     raise FileExistsError(f'Library file {destination_file.name} already'
                                           ' exists in the combined library')
-                shutil.copy(source_file, args.destination)
+                copy_file(source_file, destination_file, args.link)
             print(f'Adding {source_file.name} from {args.libraries[lib_num].resolve()}')
-            combined_library.register_file(destination_file)
+            add_library(combined_library, library, destination_file)
 
 # Write .xml file
 combined_library_path = args.destination / args.outputfilename
@@ -67,7 +67,7 @@ args = parser.parse_args()
 
 def fendl30_k39(file_path):
     """ Function to check for k-39 error in FENDL-3.0"""
-    if 'Inf' in open(file_path, 'r').read():
+    if b'Inf' in file_path.read_bytes():
         ace_error_warning = """
         {} contains 'Inf' values within the XSS array
         which prevent conversion to a HDF5 file format. This is a known issue
@@ -6,15 +6,19 @@ HDF5 library for use with OpenMC.
 """
 
 import argparse
-import tarfile
 import zipfile
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from multiprocessing import Pool
 from pathlib import Path
 from string import digits
 from urllib.parse import urljoin
 
 import openmc.data
-from utils import download
+from utils import (cache_key, convert_all, download, export_to_hdf5,
+                   extract_tar, extraction_workers, fetch_cached, find_files,
+                   pipeline, store_cached)
 
 
 class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
@@ -22,144 +26,33 @@ class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
     pass
 
 
-parser = argparse.ArgumentParser(
-    description=__doc__,
-    formatter_class=CustomFormatter
-)
-parser.add_argument('-d', '--destination', type=Path, default=None,
-                    help='Directory to create new library in')
-parser.add_argument('--download', action='store_true',
-                    help='Download files from OECD-NEA')
-parser.add_argument('--no-download', dest='download', action='store_false',
-                    help='Do not download files from OECD-NEA')
-parser.add_argument('--extract', action='store_true',
-                    help='Extract tar/zip files')
-parser.add_argument('--no-extract', dest='extract', action='store_false',
-                    help='Do not extract tar/zip files')
-parser.add_argument('--libver', choices=['earliest', 'latest'],
-                    default='latest', help="Output HDF5 versioning. Use "
-                    "'earliest' for backwards compatibility or 'latest' for "
-                    "performance")
-parser.add_argument('-r', '--release', choices=['3.2'],
-                    default='3.2', help="The nuclear data library release version. "
-                    "The currently supported options are 3.2")
-parser.add_argument('-t', '--temperatures',
-                    choices=['293', '400', '500', '600', '700', '800', '900',
-                             '1000', '1200', '1500', '1800'],
-                    default=['293', '400', '500', '600', '700', '800', '900',
-                             '1000', '1200', '1500', '1800'],
-                    help="Temperatures to download in Kelvin", nargs='+')
-parser.add_argument('--cleanup', action='store_true',
-                    help="Remove download directories when data has "
-                    "been processed")
-parser.add_argument('--no-cleanup', dest='cleanup', action='store_false',
-                    help="Do not remove download directories when data has "
-                    "been processed")
-parser.set_defaults(download=True, extract=True, cleanup=False)
-args = parser.parse_args()
-
-library_name = 'jeff'
-
-cwd = Path.cwd()
-
-ace_files_dir = cwd.joinpath('-'.join([library_name, args.release, 'ace']))
-download_path = cwd.joinpath('-'.join([library_name, args.release, 'download']))
-# the destination is decided after the release is know to avoid putting the release in a folder with a misleading name
-if args.destination is None:
-    args.destination = Path('-'.join([library_name, args.release, 'hdf5']))
-
-# This dictionary contains all the unique information about each release. This can be exstened to accommodated new releases
-release_details = {
-    '3.2': {
-        'base_url': 'https://www.oecd-nea.org/dbforms/data/eva/evatapes/jeff_32/Processed/',
-        'compressed_files': [f'JEFF32-ACE-{t}K.zip' if t == '800' else f'JEFF32-ACE-{t}K.tar.gz' for t in args.temperatures]
-                  +['TSLs.tar.gz'],
-        'neutron_files': ace_files_dir.rglob('*.ACE'),
-        'metastables': ace_files_dir.rglob('*M.ACE'),
-        'sab_files': ace_files_dir.glob('ANNEX_6_3_STLs/*/*.ace'),
-        'redundant': ace_files_dir.glob('ACEs_293K/*-293.ACE'),
-        'compressed_file_size': 9,
-        'uncompressed_file_size': 40
-    }
-}
-
-download_warning = """
-WARNING: This script will download up to {} GB of data. Extracting and
-processing the data may require as much as {} GB of additional free disk
-space. Note that if you don't need all 11 temperatures, you can used the
---temperature argument to download only the temperatures you want.
-""".format(release_details[args.release]['compressed_file_size'],
-           release_details[args.release]['uncompressed_file_size'])
-
-# ==============================================================================
-# DOWNLOAD FILES FROM OECD SITE
-
-if args.download:
-    print(download_warning)
-    for f in release_details[args.release]['compressed_files']:
-        download(urljoin(release_details[args.release]['base_url'], f),
-                 output_path=download_path)
-
-# ==============================================================================
-# EXTRACT FILES FROM TGZ
-
-if args.extract:
-    for f in release_details[args.release]['compressed_files']:
-        # Extract files
-        if f.endswith('.zip'):
-            with zipfile.ZipFile(download_path / f, 'r') as zipf:
-                print('Extracting {}...'.format(f))
-                zipf.extractall(ace_files_dir)
-
-        else:
-            suffix = 'ACEs_293K' if '293' in f else ''
-            with tarfile.open(download_path / f, 'r') as tgz:
-                print('Extracting {}...'.format(f))
-                tgz.extractall(ace_files_dir / suffix)
-
-            # Remove thermal scattering tables from 293K data since they are
-            # redundant
-            if '293' in f:
-                for path in release_details[args.release]['redundant']:
-                    print(f'removing {path}')
-                    path.unlink()
-
-
-# ==============================================================================
-# CHANGE ZAID FOR METASTABLES
-
-metastables = release_details[args.release]['metastables']
-for path in metastables:
-    print('    Fixing {} (ensure metastable)...'.format(path))
-    text = open(path, 'r').read()
-    mass_first_digit = int(text[3])
-    if mass_first_digit <= 2:
-        text = text[:3] + str(mass_first_digit + 4) + text[4:]
-        open(path, 'w').write(text)
+@lru_cache(maxsize=None)
+def directory_temperature(name):
+    """Return the temperature in K of the tables in a directory, e.g.
+    ACEs_293K -> 293"""
+    return int(name.split('_')[1][:-1])
 
-# ==============================================================================
-# GENERATE HDF5 LIBRARY -- NEUTRON FILES
 
-# Get a list of all ACE files
-neutron_files = release_details[args.release]['neutron_files']
-
-# Group together tables for same nuclide
-tables = defaultdict(list)
-for filename in sorted(neutron_files):
-    name = filename.stem
-    tables[name].append(filename)
-
-# Sort temperatures from lowest to highest
-for name, filenames in sorted(tables.items()):
-    filenames.sort(key=lambda x: int(
-        x.parts[-2].split('_')[1][:-1]))
+def get_thermal_table(filename):
+    """Read S(a,b) ACE table, taking numbers out of the table name, e.g.
+    lw10.32t -> lw.32t"""
+    table = openmc.data.ace.get_table(filename)
+    name, xs = table.name.split('.')
+    table.name = '.'.join((name.strip(digits), xs))
+    return table
 
-# Create output directory if it doesn't exist
-args.destination.mkdir(parents=True, exist_ok=True)
 
-library = openmc.data.DataLibrary()
+def convert_neutron(filenames, destination, libver, compress, cache_dir,
+                    scratch_dir):
+    """Convert ACE tables for one nuclide at several temperatures into a
+    single HDF5 file and return its path"""
+    if cache_dir is not None:
+        key = cache_key(filenames, 'neutron', libver, compress)
+        h5_file = fetch_cached(cache_dir, key, destination)
+        if h5_file is not None:
+            print(f'Using cached {h5_file} for {filenames[0]}')
+            return h5_file
 
-for name, filenames in sorted(tables.items()):
     # Convert first temperature for the table
     print('Converting: ' + str(filenames[0]))
     data = openmc.data.IncidentNeutron.from_ace(filenames[0])
@@ -170,52 +63,251 @@ for name, filenames in sorted(tables.items()):
         data.add_temperature_from_ace(filename)
 
     # Export HDF5 file
-    h5_file = args.destination / f'{data.name}.h5'
+    h5_file = destination / f'{data.name}.h5'
     print('Writing {}...'.format(h5_file))
-    data.export_to_hdf5(h5_file, 'w', libver=args.libver)
+    export_to_hdf5(data, h5_file, libver, compress, scratch_dir)
 
-    # Register with library
-    library.register_file(h5_file)
+    if cache_dir is not None:
+        store_cached(cache_dir, key, h5_file)
+    return h5_file
 
-# ==============================================================================
-# GENERATE HDF5 LIBRARY -- S(A,B) FILES
 
-# Group together tables for same nuclide
-tables = defaultdict(list)
-for filename in sorted(release_details[args.release]['sab_files']):
-    name = filename.name.split('-')[0]
-    tables[name].append(filename)
+def convert_thermal(filenames, destination, libver, compress, cache_dir,
+                    scratch_dir):
+    """Convert S(a,b) ACE tables for one material at several temperatures into
+    a single HDF5 file and return its path"""
+    if cache_dir is not None:
+        key = cache_key(filenames, 'thermal', libver, compress)
+        h5_file = fetch_cached(cache_dir, key, destination)
+        if h5_file is not None:
+            print(f'Using cached {h5_file} for {filenames[0]}')
+            return h5_file
 
-# Sort temperatures from lowest to highest
-for name, filenames in sorted(tables.items()):
-    filenames.sort(key=lambda x: int(
-        x.name.split('-')[1].split('.')[0]))
-
-for name, filenames in sorted(tables.items()):
     # Convert first temperature for the table
     print(f'Converting: {filenames[0]}')
-
-    # Take numbers out of table name, e.g. lw10.32t -> lw.32t
-    table = openmc.data.ace.get_table(filenames[0])
-    name, xs = table.name.split('.')
-    table.name = '.'.join((name.strip(digits), xs))
-    data = openmc.data.ThermalScattering.from_ace(table)
+    data = openmc.data.ThermalScattering.from_ace(get_thermal_table(filenames[0]))
 
     # For each higher temperature, add cross sections to the existing table
     for filename in filenames[1:]:
         print(f'Adding: {filename}')
-        table = openmc.data.ace.get_table(filename)
-        name, xs = table.name.split('.')
-        table.name = '.'.join((name.strip(digits), xs))
-        data.add_temperature_from_ace(table)
+        data.add_temperature_from_ace(get_thermal_table(filename))
 
     # Export HDF5 file
-    h5_file = args.destination / f'{data.name}.h5'
+    h5_file = destination / f'{data.name}.h5'
     print('Writing {}...'.format(h5_file))
-    data.export_to_hdf5(h5_file, 'w', libver=args.libver)
+    export_to_hdf5(data, h5_file, libver, compress, scratch_dir)
+
+    if cache_dir is not None:
+        store_cached(cache_dir, key, h5_file)
+    return h5_file
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=CustomFormatter
+    )
+    parser.add_argument('-d', '--destination', type=Path, default=None,
+                        help='Directory to create new library in')
+    parser.add_argument('--download', action='store_true',
+                        help='Download files from OECD-NEA')
+    parser.add_argument('--no-download', dest='download', action='store_false',
+                        help='Do not download files from OECD-NEA')
+    parser.add_argument('--extract', action='store_true',
+                        help='Extract tar/zip files')
+    parser.add_argument('--no-extract', dest='extract', action='store_false',
+                        help='Do not extract tar/zip files')
+    parser.add_argument('--libver', choices=['earliest', 'latest'],
+                        default='latest', help="Output HDF5 versioning. Use "
+                        "'earliest' for backwards compatibility or 'latest' for "
+                        "performance")
+    parser.add_argument('--compress', action='store_true',
+                        help="Store large datasets with gzip compression to "
+                        "reduce the size of the library")
+    parser.add_argument('--cache-dir', type=Path, default=None,
+                        help="Directory in which to cache HDF5 files so that "
+                        "unchanged evaluations are not reprocessed on later runs")
+    parser.add_argument('--scratch-dir', type=Path, default=None,
+                        help="Directory on a fast local filesystem, e.g. "
+                        "/dev/shm, in which to write HDF5 files before moving "
+                        "them to the destination")
+    parser.add_argument('-r', '--release', choices=['3.2'],
+                        default='3.2', help="The nuclear data library release version. "
+                        "The currently supported options are 3.2")
+    parser.add_argument('-t', '--temperatures',
+                        choices=['293', '400', '500', '600', '700', '800', '900',
+                                 '1000', '1200', '1500', '1800'],
+                        default=['293', '400', '500', '600', '700', '800', '900',
+                                 '1000', '1200', '1500', '1800'],
+                        help="Temperatures to download in Kelvin", nargs='+')
+    parser.add_argument('--force', action='store_true',
+                        help="Convert all tables even if the HDF5 files from a "
+                        "previous run are newer than the ACE files")
+    parser.add_argument('--cleanup', action='store_true',
+                        help="Remove download directories when data has "
+                        "been processed")
+    parser.add_argument('--no-cleanup', dest='cleanup', action='store_false',
+                        help="Do not remove download directories when data has "
+                        "been processed")
+    parser.set_defaults(download=True, extract=True, cleanup=False)
+    args = parser.parse_args()
+
+    library_name = 'jeff'
+
+    cwd = Path.cwd()
+
+    ace_files_dir = cwd.joinpath('-'.join([library_name, args.release, 'ace']))
+    download_path = cwd.joinpath('-'.join([library_name, args.release, 'download']))
+    # the destination is decided after the release is know to avoid putting the release in a folder with a misleading name
+    if args.destination is None:
+        args.destination = Path('-'.join([library_name, args.release, 'hdf5']))
+
+    # This dictionary contains all the unique information about each release. This can be exstened to accommodated new releases
+    release_details = {
+        '3.2': {
+            'base_url': 'https://www.oecd-nea.org/dbforms/data/eva/evatapes/jeff_32/Processed/',
+            'compressed_files': [f'JEFF32-ACE-{t}K.zip' if t == '800' else f'JEFF32-ACE-{t}K.tar.gz' for t in args.temperatures]
+                      +['TSLs.tar.gz'],
+            'neutron_files': '**/*.ACE',
+            'metastables': '**/*M.ACE',
+            'sab_files': 'ANNEX_6_3_STLs/*/*.ace',
+            'redundant': 'ACEs_293K/*-293.ACE',
+            'compressed_file_size': 9,
+            'uncompressed_file_size': 40
+        }
+    }
+
+    download_warning = """
+    WARNING: This script will download up to {} GB of data. Extracting and
+    processing the data may require as much as {} GB of additional free disk
+    space. Note that if you don't need all 11 temperatures, you can used the
+    --temperature argument to download only the temperatures you want.
+    """.format(release_details[args.release]['compressed_file_size'],
+               release_details[args.release]['uncompressed_file_size'])
+
+    # ==============================================================================
+    # DOWNLOAD AND EXTRACT FILES FROM OECD SITE
+
+    def download_file(f):
+        return download(urljoin(release_details[args.release]['base_url'], f),
+                        output_path=download_path, connections=4)
+
+    compressed_files = release_details[args.release]['compressed_files']
+    if args.download:
+        print(download_warning)
+        # Download in a background thread so that each file can be extracted while
+        # the next one is still downloading
+        local_files = pipeline(download_file, compressed_files)
+    else:
+        local_files = (download_path / f for f in compressed_files)
+
+    def extract_file(archive):
+        f = archive.name
+        if f.endswith('.zip'):
+            with zipfile.ZipFile(archive, 'r') as zipf:
+                print('Extracting {}...'.format(f))
+                zipf.extractall(ace_files_dir)
+
+        else:
+            suffix = 'ACEs_293K' if '293' in f else ''
+            print('Extracting {}...'.format(f))
+            extract_tar(archive, ace_files_dir / suffix)
+
+            # Remove thermal scattering tables from 293K data since they are
+            # redundant
+            if '293' in f:
+                redundant = release_details[args.release]['redundant']
+                for path in ace_files_dir.glob(redundant):
+                    print(f'removing {path}')
+                    path.unlink()
+
+    # Archives are extracted concurrently unless a parallel decompressor is
+    # available, since decompression of each one is otherwise limited to a
+    # single core
+    ace_files_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(extraction_workers(compressed_files)) as executor:
+        futures = [executor.submit(extract_file, archive)
+                   for archive in local_files if args.extract]
+        for future in futures:
+            future.result()
+
+    # ==============================================================================
+    # CHANGE ZAID FOR METASTABLES
+
+    # Find neutron tables and the metastable ones among them in a single walk
+    details = release_details[args.release]
+    ace_files = find_files(ace_files_dir, {
+        'neutron_files': details['neutron_files'],
+        'metastables': details['metastables']
+    })
+
+    for path in ace_files['metastables']:
+        print('    Fixing {} (ensure metastable)...'.format(path))
+        # Only a single character of the ZAID needs to change, so patch it in place
+        # rather than rewriting the whole file
+        with open(path, 'r+b', buffering=0) as fh:
+            fh.seek(3)
+            mass_first_digit = int(fh.read(1))
+            if mass_first_digit <= 2:
+                fh.seek(3)
+                fh.write(str(mass_first_digit + 4).encode())
+
+    # ==============================================================================
+    # GROUP TABLES -- NEUTRON FILES
+
+    # Group together tables for same nuclide
+    neutron_tables = defaultdict(list)
+    for filename in ace_files['neutron_files']:
+        neutron_tables[filename.stem].append(filename)
+
+    # Sort temperatures from lowest to highest. Only the tables within each
+    # group need sorting; the groups themselves are sorted once when they are
+    # submitted for conversion.
+    def neutron_temperature(path):
+        return directory_temperature(path.parent.name)
+
+    for filenames in neutron_tables.values():
+        filenames.sort(key=neutron_temperature)
+
+    # ==============================================================================
+    # GROUP TABLES -- S(A,B) FILES
+
+    # Group together tables for same nuclide
+    thermal_tables = defaultdict(list)
+    for filename in ace_files_dir.glob(release_details[args.release]['sab_files']):
+        name = filename.name.split('-')[0]
+        thermal_tables[name].append(filename)
+
+    # Sort temperatures from lowest to highest
+    for filenames in thermal_tables.values():
+        filenames.sort(key=lambda x: int(
+            x.name.split('-')[1].split('.')[0]))
+
+    # ==============================================================================
+    # GENERATE HDF5 LIBRARY IN PARALLEL
+
+    # Create output directory if it doesn't exist
+    args.destination.mkdir(parents=True, exist_ok=True)
+    if args.scratch_dir is not None:
+        args.scratch_dir.mkdir(parents=True, exist_ok=True)
+
+    options = (args.destination, args.libver, args.compress, args.cache_dir,
+               args.scratch_dir)
+    jobs = [(convert_neutron, filenames, (filenames,) + options)
+            for _, filenames in sorted(neutron_tables.items())]
+    jobs += [(convert_thermal, filenames, (filenames,) + options)
+             for _, filenames in sorted(thermal_tables.items())]
+    with Pool() as pool:
+        h5_files = convert_all(pool, jobs, args.destination, args.force)
 
     # Register with library
-    library.register_file(h5_file)
+    library = openmc.data.DataLibrary()
+    for h5_file in h5_files:
+        library.register_file(h5_file)
+
+    # Write cross_sections.xml
+    library.export_to_xml(args.destination / 'cross_sections.xml')
+
 
-# Write cross_sections.xml
-library.export_to_xml(args.destination / 'cross_sections.xml')
+if __name__ == '__main__':
+    main()
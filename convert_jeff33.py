@@ -7,16 +7,18 @@ extract them, convert them, and write HDF5 files into a destination directory.
 """
 
 import argparse
-import tarfile
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
 from pathlib import Path
 from shutil import rmtree
 from urllib.parse import urljoin
 
 import openmc.data
 
-from utils import download
+from utils import (convert_all, download, export_to_hdf5, extract_tar,
+                   extraction_workers, pipeline)
 
 
 # Make sure Python version is sufficient
@@ -28,108 +30,27 @@ class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
     pass
 
 
-parser = argparse.ArgumentParser(
-    description=__doc__,
-    formatter_class=CustomFormatter
-)
-parser.add_argument('-d', '--destination', type=Path, default=Path('jeff-3.3-hdf5'),
-                    help='Directory to create new library in')
-parser.add_argument('--download', action='store_true',
-                    help='Download tarball from OECD-NEA')
-parser.add_argument('--no-download', dest='download', action='store_false',
-                    help='Do not download tarball from OECD-NEA')
-parser.add_argument('--extract', action='store_true',
-                    help='Extract zip files')
-parser.add_argument('--no-extract', dest='extract', action='store_false',
-                    help='Do not extract .tgz file if it has already been extracted')
-parser.add_argument('--libver', choices=['earliest', 'latest'],
-                    default='earliest', help="Output HDF5 versioning. Use "
-                    "'earliest' for backwards compatibility or 'latest' for "
-                    "performance")
-parser.add_argument('-r', '--release', choices=['3.3'],
-                    default='3.3', help="The nuclear data library release version. "
-                    "The only currently supported option is 3.3.")
-parser.add_argument('--cleanup', action='store_true',
-                    help="Remove download directories when data has "
-                    "been processed")
-parser.add_argument('--no-cleanup', dest='cleanup', action='store_false',
-                    help="Do not remove download directories when data has "
-                    "been processed")
-parser.set_defaults(download=True, extract=True, cleanup=False)
-args = parser.parse_args()
-
-library_name = 'jeff'
-
-cwd = Path.cwd()
-
-ace_files_dir = cwd.joinpath('-'.join([library_name, args.release, 'ace']))
-download_path = cwd.joinpath('-'.join([library_name, args.release, 'download']))
-
-# This dictionary contains all the unique information about each release. This
-# can be extended to accommodate new releases
-release_details = {
-    '3.3': {
-        'base_url': 'http://www.oecd-nea.org/dbdata/jeff/jeff33/downloads/temperatures/',
-        'compressed_files': [
-            'ace_293.tar.gz',
-            'ace_600.tar.gz',
-            'ace_900.tar.gz',
-            'ace_1200.tar.gz',
-            'ace_1500.tar.gz',
-            'ace_1800.tar.gz',
-            'ace_tsl.tar.gz',
-        ],
-        'neutron_files': ace_files_dir.rglob('*-[A-Z]*.ace'),
-        'thermal_files': (ace_files_dir / 'ace_tsl').glob('*.ace'),
-        'metastables': ace_files_dir.rglob('*[0-9]m-*.ace'),
-        'compressed_file_size': '7.7 GB',
-        'uncompressed_file_size': '37 GB'
-    }
-}
-
-details = release_details[args.release]
-
-# ==============================================================================
-# DOWNLOAD FILES FROM WEBSITE
-
-download_warning = """
-WARNING: This script will download {} of data.
-Extracting and processing the data requires {} of additional free disk space.
-""".format(details['compressed_file_size'], details['uncompressed_file_size'])
-
-if args.download:
-    print(download_warning)
-    for f in details['compressed_files']:
-        download(urljoin(details['base_url'], f), output_path=download_path)
-
-# ==============================================================================
-# EXTRACT FILES FROM TGZ
-
-if args.extract:
-    for f in details['compressed_files']:
-        with tarfile.open(download_path / f, 'r') as tgz:
-            print(f'Extracting {f}...')
-            tgz.extractall(path=ace_files_dir)
-
-    if args.cleanup and download_path.exists():
-        rmtree(download_path)
-
-# ==============================================================================
-# CONVERT INCIDENT NEUTRON FILES
-
-# Create output directory if it doesn't exist
-args.destination.mkdir(parents=True, exist_ok=True)
-
-lib = openmc.data.DataLibrary()
-
-
 def key(p):
     """Return (temperature, atomic number, mass number, metastable)"""
     z, x, a, temp = p.stem.split('-')
     return int(temp), int(z), int(a[:-1]), a[-1]
 
 
-for p in sorted((ace_files_dir / 'ace_293').glob('*.ace'), key=key):
+def thermal_temp(p):
+    return int(p.stem.split('-')[-1])
+
+
+def temperature_paths(p, ace_files_dir):
+    """Return the 293 K ACE table for a nuclide followed by the tables for the
+    higher temperatures"""
+    return [p] + [ace_files_dir / f'ace_{T}' / (p.stem.replace('293', T) + '.ace')
+                  for T in ('600', '900', '1200', '1500', '1800')]
+
+
+def convert_neutron(paths, destination, libver, compress):
+    """Convert the 293 K ACE table for a nuclide, add the higher temperatures
+    and write it to an HDF5 file whose path is returned"""
+    p = paths[0]
     print(f'Converting: {p}')
     temp, z, a, m = key(p)
 
@@ -139,50 +60,19 @@ for p in sorted((ace_files_dir / 'ace_293').glob('*.ace'), key=key):
         data.metastable = 1
         data.name += '_m1'
 
-    for T in ('600', '900', '1200', '1500', '1800'):
-        p_add = ace_files_dir / f'ace_{T}' / (p.stem.replace('293', T) + '.ace')
+    for p_add in paths[1:]:
         print(f'Adding temperature: {p_add}')
         data.add_temperature_from_ace(p_add)
 
-    h5_file = args.destination / f'{data.name}.h5'
-    data.export_to_hdf5(h5_file, 'w', libver=args.libver)
-    lib.register_file(h5_file)
-
-# ==============================================================================
-# CONVERT THERMAL SCATTERING FILES
-
-thermal_mats = [
-    'al-sap',
-    'be',
-    'ca-cah2',
-    'd-d2o',
-    'graph',
-    'h-cah2',
-    'h-ch2',
-    'h-h2o',
-    'h-ice',
-    'h-zrh',
-    'mesi',
-    'mg',
-    'o-d2o',
-    'orto-d',
-    'orto-h',
-    'o-sap',
-    'para-d',
-    'para-h',
-    'sili',
-    'tolu',
-]
-
+    h5_file = destination / f'{data.name}.h5'
+    export_to_hdf5(data, h5_file, libver, compress)
+    return h5_file
 
-def thermal_temp(p):
-    return int(p.stem.split('-')[-1])
-
-
-thermal_dir = ace_files_dir / 'ace_tsl'
 
-for mat in thermal_mats:
-    for i, p in enumerate(sorted(thermal_dir.glob(f'{mat}*.ace'), key=thermal_temp)):
+def convert_thermal(paths, destination, libver, compress):
+    """Convert the ACE tables for a thermal scattering material, sorted by
+    temperature, into an HDF5 file whose path is returned"""
+    for i, p in enumerate(paths):
         if i == 0:
             print(f'Converting: {p}')
             data = openmc.data.ThermalScattering.from_ace(p)
@@ -190,8 +80,169 @@ for mat in thermal_mats:
             print(f'Adding temperature: {p}')
             data.add_temperature_from_ace(p)
 
-    h5_file = args.destination / f'{data.name}.h5'
-    data.export_to_hdf5(h5_file, 'w', libver=args.libver)
-    lib.register_file(h5_file)
+    h5_file = destination / f'{data.name}.h5'
+    export_to_hdf5(data, h5_file, libver, compress)
+    return h5_file
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=CustomFormatter
+    )
+    parser.add_argument('-d', '--destination', type=Path, default=Path('jeff-3.3-hdf5'),
+                        help='Directory to create new library in')
+    parser.add_argument('--download', action='store_true',
+                        help='Download tarball from OECD-NEA')
+    parser.add_argument('--no-download', dest='download', action='store_false',
+                        help='Do not download tarball from OECD-NEA')
+    parser.add_argument('--extract', action='store_true',
+                        help='Extract zip files')
+    parser.add_argument('--no-extract', dest='extract', action='store_false',
+                        help='Do not extract .tgz file if it has already been extracted')
+    parser.add_argument('--libver', choices=['earliest', 'latest'],
+                        default='latest', help="Output HDF5 versioning. Use "
+                        "'earliest' for backwards compatibility or 'latest' for "
+                        "performance")
+    parser.add_argument('--compress', action='store_true',
+                        help="Store large datasets with gzip compression to "
+                        "reduce the size of the library")
+    parser.add_argument('-r', '--release', choices=['3.3'],
+                        default='3.3', help="The nuclear data library release version. "
+                        "The only currently supported option is 3.3.")
+    parser.add_argument('--force', action='store_true',
+                        help="Convert all tables even if the HDF5 files from a "
+                        "previous run are newer than the ACE files")
+    parser.add_argument('--cleanup', action='store_true',
+                        help="Remove download directories when data has "
+                        "been processed")
+    parser.add_argument('--no-cleanup', dest='cleanup', action='store_false',
+                        help="Do not remove download directories when data has "
+                        "been processed")
+    parser.set_defaults(download=True, extract=True, cleanup=False)
+    args = parser.parse_args()
+
+    library_name = 'jeff'
+
+    cwd = Path.cwd()
+
+    ace_files_dir = cwd.joinpath('-'.join([library_name, args.release, 'ace']))
+    download_path = cwd.joinpath('-'.join([library_name, args.release, 'download']))
+
+    # This dictionary contains all the unique information about each release. This
+    # can be extended to accommodate new releases
+    release_details = {
+        '3.3': {
+            'base_url': 'http://www.oecd-nea.org/dbdata/jeff/jeff33/downloads/temperatures/',
+            'compressed_files': [
+                'ace_293.tar.gz',
+                'ace_600.tar.gz',
+                'ace_900.tar.gz',
+                'ace_1200.tar.gz',
+                'ace_1500.tar.gz',
+                'ace_1800.tar.gz',
+                'ace_tsl.tar.gz',
+            ],
+            'neutron_files': ace_files_dir.rglob('*-[A-Z]*.ace'),
+            'thermal_files': (ace_files_dir / 'ace_tsl').glob('*.ace'),
+            'metastables': ace_files_dir.rglob('*[0-9]m-*.ace'),
+            'compressed_file_size': '7.7 GB',
+            'uncompressed_file_size': '37 GB'
+        }
+    }
+
+    details = release_details[args.release]
+
+    # ==============================================================================
+    # DOWNLOAD AND EXTRACT FILES FROM WEBSITE
+
+    download_warning = """
+    WARNING: This script will download {} of data.
+    Extracting and processing the data requires {} of additional free disk space.
+    """.format(details['compressed_file_size'], details['uncompressed_file_size'])
+
+    def download_file(f):
+        return download(urljoin(details['base_url'], f), output_path=download_path)
+
+    if args.download:
+        print(download_warning)
+        # Download in a background thread so that each file can be extracted
+        # while the next one is still downloading
+        local_files = pipeline(download_file, details['compressed_files'])
+    else:
+        local_files = (download_path / f for f in details['compressed_files'])
+
+    def extract_file(path):
+        print(f'Extracting {path.name}...')
+        extract_tar(path, ace_files_dir)
+
+    # Archives are extracted concurrently unless a parallel decompressor is
+    # available, since decompression of each one is otherwise limited to a
+    # single core
+    ace_files_dir.mkdir(parents=True, exist_ok=True)
+    workers = extraction_workers(details['compressed_files'])
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(extract_file, path)
+                   for path in local_files if args.extract]
+        for future in futures:
+            future.result()
+
+    if args.extract and args.cleanup and download_path.exists():
+        rmtree(download_path)
 
-lib.export_to_xml(args.destination / 'cross_sections.xml')
+    # ==============================================================================
+    # CONVERT INCIDENT NEUTRON AND THERMAL SCATTERING FILES IN PARALLEL
+
+    # Create output directory if it doesn't exist
+    args.destination.mkdir(parents=True, exist_ok=True)
+
+    thermal_mats = [
+        'al-sap',
+        'be',
+        'ca-cah2',
+        'd-d2o',
+        'graph',
+        'h-cah2',
+        'h-ch2',
+        'h-h2o',
+        'h-ice',
+        'h-zrh',
+        'mesi',
+        'mg',
+        'o-d2o',
+        'orto-d',
+        'orto-h',
+        'o-sap',
+        'para-d',
+        'para-h',
+        'sili',
+        'tolu',
+    ]
+
+    neutron_paths = [temperature_paths(p, ace_files_dir) for p in
+                     sorted((ace_files_dir / 'ace_293').glob('*.ace'), key=key)]
+    thermal_dir = ace_files_dir / 'ace_tsl'
+    thermal_paths = [sorted(thermal_dir.glob(f'{mat}*.ace'), key=thermal_temp)
+                     for mat in thermal_mats]
+
+    # Leave out materials for which no tables were found
+    thermal_paths = [paths for paths in thermal_paths if paths]
+
+    options = (args.destination, args.libver, args.compress)
+    jobs = [(convert_neutron, paths, (paths,) + options)
+            for paths in neutron_paths]
+    jobs += [(convert_thermal, paths, (paths,) + options)
+             for paths in thermal_paths]
+    with Pool() as pool:
+        h5_files = convert_all(pool, jobs, args.destination, args.force)
+
+    # Register with library in the same order as before
+    lib = openmc.data.DataLibrary()
+    for h5_file in h5_files:
+        lib.register_file(h5_file)
+
+    lib.export_to_xml(args.destination / 'cross_sections.xml')
+
+
+if __name__ == '__main__':
+    main()
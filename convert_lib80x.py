@@ -8,72 +8,26 @@ subdirectories 'Lib80x' and 'ENDF80SaB'.
 
 import argparse
 from collections import defaultdict
+from multiprocessing import Pool
 from pathlib import Path
 import sys
 
 import openmc.data
+from utils import convert_all, export_to_hdf5, find_files
 
 
 # Make sure Python version is sufficient
 assert sys.version_info >= (3, 6), "Python 3.6+ is required"
 
 
-
 class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
                       argparse.RawDescriptionHelpFormatter):
     pass
 
 
-parser = argparse.ArgumentParser(
-    description=__doc__,
-    formatter_class=CustomFormatter
-)
-parser.add_argument('-d', '--destination', type=Path, default=Path('lib80x_hdf5'),
-                    help='Directory to create new library in')
-parser.add_argument('--libver', choices=['earliest', 'latest'],
-                    default='earliest', help="Output HDF5 versioning. Use "
-                    "'earliest' for backwards compatibility or 'latest' for "
-                    "performance")
-parser.add_argument('datadir', type=Path,
-                    help='Directory containing Lib80x and ENDF80SaB/ENDF80SaB2')
-
-args = parser.parse_args()
-assert args.datadir.is_dir()
-
-# Get a list of all ACE files
-lib80x = list(args.datadir.glob('Lib80x/**/*.80?nc'))
-if (args.datadir / 'ENDF80SaB2').is_dir():
-    thermal_dir = args.datadir / 'ENDF80SaB2'
-else:
-    thermal_dir = args.datadir / 'ENDF80SaB'
-lib80sab = list(thermal_dir.glob('**/*.??t'))
-
-# Find and fix B10 ACE files
-b10files = list(args.datadir.glob('Lib80x/**/5010.80?nc'))
-nxs1_position = 523
-for filename in b10files:
-    with open(filename, 'r+') as fh:
-        # Read NXS(1)
-        fh.seek(nxs1_position)
-        nxs1 = int(fh.read(5))
-
-        # Increase length to match actual length of XSS, but make sure this
-        # isn't done twice by checking the current length
-        if nxs1 < 86870:
-            fh.seek(nxs1_position)
-            fh.write(str(nxs1 + 53))
-
-# Group together tables for the same nuclide
-tables = defaultdict(list)
-for p in sorted(lib80x + lib80sab):
-    tables[p.stem].append(p)
-
-# Create output directory if it doesn't exist
-args.destination.mkdir(parents=True, exist_ok=True)
-
-library = openmc.data.DataLibrary()
-
-for name, paths in sorted(tables.items()):
+def convert_group(paths, destination, libver, compress):
+    """Convert ACE tables for one nuclide or material at several temperatures
+    into a single HDF5 file and return its path"""
     # Convert first temperature for the table
     p = paths[0]
     print(f'Converting: {p}')
@@ -91,12 +45,88 @@ for name, paths in sorted(tables.items()):
             data.add_temperature_from_ace(p, 'mcnp')
 
     # Export HDF5 file
-    h5_file = args.destination / f'{data.name}.h5'
+    h5_file = destination / f'{data.name}.h5'
     print(f'Writing {h5_file}...')
-    data.export_to_hdf5(h5_file, 'w', libver=args.libver)
+    export_to_hdf5(data, h5_file, libver, compress)
+    return h5_file
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=CustomFormatter
+    )
+    parser.add_argument('-d', '--destination', type=Path, default=Path('lib80x_hdf5'),
+                        help='Directory to create new library in')
+    parser.add_argument('--libver', choices=['earliest', 'latest'],
+                        default='latest', help="Output HDF5 versioning. Use "
+                        "'earliest' for backwards compatibility or 'latest' for "
+                        "performance")
+    parser.add_argument('--compress', action='store_true',
+                        help="Store large datasets with gzip compression to "
+                        "reduce the size of the library")
+    parser.add_argument('--force', action='store_true',
+                        help="Convert all tables even if the HDF5 files from a "
+                        "previous run are newer than the source files")
+    parser.add_argument('datadir', type=Path,
+                        help='Directory containing Lib80x and ENDF80SaB/ENDF80SaB2')
+
+    args = parser.parse_args()
+    assert args.datadir.is_dir()
+
+    # Get a list of all ACE files, finding the B10 files in the same walk
+    lib80x_files = find_files(args.datadir / 'Lib80x', {
+        'lib80x': '**/*.80?nc',
+        'b10files': '**/5010.80?nc'
+    })
+    lib80x = lib80x_files['lib80x']
+    if (args.datadir / 'ENDF80SaB2').is_dir():
+        thermal_dir = args.datadir / 'ENDF80SaB2'
+    else:
+        thermal_dir = args.datadir / 'ENDF80SaB'
+    lib80sab = list(thermal_dir.glob('**/*.??t'))
+
+    # Find and fix B10 ACE files
+    nxs1_position = 523
+    for filename in lib80x_files['b10files']:
+        with open(filename, 'r+b', buffering=0) as fh:
+            # Read NXS(1)
+            fh.seek(nxs1_position)
+            nxs1 = int(fh.read(5))
+
+            # Increase length to match actual length of XSS, but make sure this
+            # isn't done twice by checking the current length
+            if nxs1 < 86870:
+                fh.seek(nxs1_position)
+                fh.write(str(nxs1 + 53).encode())
+
+    # Group together tables for the same nuclide. Only the tables within each
+    # group need to be in order; the groups themselves are sorted below.
+    tables = defaultdict(list)
+    for p in lib80x + lib80sab:
+        tables[p.stem].append(p)
+    for paths in tables.values():
+        paths.sort()
+
+    # Create output directory if it doesn't exist
+    args.destination.mkdir(parents=True, exist_ok=True)
+
+    library = openmc.data.DataLibrary()
+
+    # Convert tables in parallel and register them in sorted order
+    with Pool() as pool:
+        h5_files = convert_all(pool, [
+            (convert_group, paths,
+             (paths, args.destination, args.libver, args.compress))
+            for _, paths in sorted(tables.items())
+        ], args.destination, args.force)
+
+    for h5_file in h5_files:
+        library.register_file(h5_file)
+
+    # Write cross_sections.xml
+    library.export_to_xml(args.destination / 'cross_sections.xml')
 
-    # Register with library
-    library.register_file(h5_file)
 
-# Write cross_sections.xml
-library.export_to_xml(args.destination / 'cross_sections.xml')
+if __name__ == '__main__':
+    main()
@@ -10,52 +10,26 @@ library (e.g., eprdata14) is available, it can also be converted using the
 
 import argparse
 from collections import defaultdict
+from multiprocessing import Pool
 from pathlib import Path
 import sys
 
 import openmc.data
+from utils import convert_all, export_to_hdf5
 
 
 # Make sure Python version is sufficient
 assert sys.version_info >= (3, 6), "Python 3.6+ is required"
 
 
-
 class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
                       argparse.RawDescriptionHelpFormatter):
     pass
 
 
-parser = argparse.ArgumentParser(
-    description=__doc__,
-    formatter_class=CustomFormatter
-)
-parser.add_argument('-d', '--destination', type=Path, default=Path('mcnp_endfb70'),
-                    help='Directory to create new library in')
-parser.add_argument('--libver', choices=['earliest', 'latest'],
-                    default='earliest', help="Output HDF5 versioning. Use "
-                    "'earliest' for backwards compatibility or 'latest' for "
-                    "performance")
-parser.add_argument('-p', '--photon', type=Path,
-                    help='Path to photoatomic data library (eprdata12 or later)')
-parser.add_argument('mcnpdata', type=Path,
-                    help="Directory containing endf70[a-k], endf70sab, and mcplib")
-args = parser.parse_args()
-
-# Check arguments to make sure they're valid
-assert args.mcnpdata.is_dir(), 'mcnpdata argument must be a directory'
-if args.photon is not None:
-    assert args.photon.is_file(), 'photon argument must be an existing file'
-
-# Get a list of all neutron ACE files
-endf70 = args.mcnpdata.glob('endf70[a-k]')
-
-# Create output directory if it doesn't exist
-(args.destination / 'photon').mkdir(parents=True, exist_ok=True)
-
-library = openmc.data.DataLibrary()
-
-for path in sorted(endf70):
+def convert_neutron(path, destination, libver, compress):
+    """Convert all incident neutron tables in an ACE library file into HDF5
+    files and return their paths"""
     print(f'Loading data from {path}...')
     lib = openmc.data.ace.Library(path)
 
@@ -65,6 +39,7 @@ for path in sorted(endf70):
         zaid, xs = table.name.split('.')
         tables[zaid].append(table)
 
+    h5_files = []
     for zaid, tables in sorted(tables.items()):
         # Convert first temperature for the table
         print(f'Converting: {tables[0].name}')
@@ -76,17 +51,17 @@ for path in sorted(endf70):
             data.add_temperature_from_ace(table, 'mcnp')
 
         # Export HDF5 file
-        h5_file = args.destination / f'{data.name}.h5'
+        h5_file = destination / f'{data.name}.h5'
         print(f'Writing {h5_file}...')
-        data.export_to_hdf5(h5_file, 'w', libver=args.libver)
+        export_to_hdf5(data, h5_file, libver, compress)
+        h5_files.append(h5_file)
+    return h5_files
 
-        # Register with library
-        library.register_file(h5_file)
 
-# Handle S(a,b) tables
-endf70sab = args.mcnpdata / 'endf70sab'
-if endf70sab.exists():
-    lib = openmc.data.ace.Library(endf70sab)
+def convert_thermal(path, destination, libver, compress):
+    """Convert all S(a,b) tables in an ACE library file into HDF5 files and
+    return their paths"""
+    lib = openmc.data.ace.Library(path)
 
     # Group together tables for the same nuclide
     tables = defaultdict(list)
@@ -94,6 +69,7 @@ if endf70sab.exists():
         name, xs = table.name.split('.')
         tables[name].append(table)
 
+    h5_files = []
     for zaid, tables in sorted(tables.items()):
         # Convert first temperature for the table
         print(f'Converting: {tables[0].name}')
@@ -105,29 +81,93 @@ if endf70sab.exists():
             data.add_temperature_from_ace(table)
 
         # Export HDF5 file
-        h5_file = args.destination / f'{data.name}.h5'
+        h5_file = destination / f'{data.name}.h5'
         print(f'Writing {h5_file}...')
-        data.export_to_hdf5(h5_file, 'w', libver=args.libver)
+        export_to_hdf5(data, h5_file, libver, compress)
+        h5_files.append(h5_file)
+    return h5_files
 
-        # Register with library
-        library.register_file(h5_file)
 
-# Handle photoatomic data
-if args.photon is not None:
-    lib = openmc.data.ace.Library(args.photon)
+def convert_photon(path, destination, libver, compress):
+    """Convert all photoatomic tables in an ACE library file into HDF5 files
+    and return their paths"""
+    lib = openmc.data.ace.Library(path)
 
+    h5_files = []
     for table in lib.tables:
         # Convert first temperature for the table
         print(f'Converting: {table.name}')
         data = openmc.data.IncidentPhoton.from_ace(table)
 
         # Export HDF5 file
-        h5_file = args.destination / 'photon' / f'{data.name}.h5'
+        h5_file = destination / 'photon' / f'{data.name}.h5'
         print(f'Writing {h5_file}...')
-        data.export_to_hdf5(h5_file, 'w', libver=args.libver)
-
-        # Register with library
-        library.register_file(h5_file)
-
-# Write cross_sections.xml
-library.export_to_xml(args.destination / 'cross_sections.xml')
+        export_to_hdf5(data, h5_file, libver, compress)
+        h5_files.append(h5_file)
+    return h5_files
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=CustomFormatter
+    )
+    parser.add_argument('-d', '--destination', type=Path, default=Path('mcnp_endfb70'),
+                        help='Directory to create new library in')
+    parser.add_argument('--libver', choices=['earliest', 'latest'],
+                        default='latest', help="Output HDF5 versioning. Use "
+                        "'earliest' for backwards compatibility or 'latest' for "
+                        "performance")
+    parser.add_argument('--compress', action='store_true',
+                        help="Store large datasets with gzip compression to "
+                        "reduce the size of the library")
+    parser.add_argument('--force', action='store_true',
+                        help="Convert all tables even if the HDF5 files from a "
+                        "previous run are newer than the source files")
+    parser.add_argument('-p', '--photon', type=Path,
+                        help='Path to photoatomic data library (eprdata12 or later)')
+    parser.add_argument('mcnpdata', type=Path,
+                        help="Directory containing endf70[a-k], endf70sab, and mcplib")
+    args = parser.parse_args()
+
+    # Check arguments to make sure they're valid
+    assert args.mcnpdata.is_dir(), 'mcnpdata argument must be a directory'
+    if args.photon is not None:
+        assert args.photon.is_file(), 'photon argument must be an existing file'
+
+    # Get a list of all neutron ACE files
+    endf70 = args.mcnpdata.glob('endf70[a-k]')
+
+    # Create output directory if it doesn't exist
+    (args.destination / 'photon').mkdir(parents=True, exist_ok=True)
+
+    # Each ACE library file holds many tables. Convert the files in parallel,
+    # each one in a single worker, to avoid sending tables between processes
+    options = (args.destination, args.libver, args.compress)
+    jobs = [(convert_neutron, [path], (path,) + options)
+            for path in sorted(endf70)]
+
+    # Handle S(a,b) tables
+    endf70sab = args.mcnpdata / 'endf70sab'
+    if endf70sab.exists():
+        jobs.append((convert_thermal, [endf70sab], (endf70sab,) + options))
+
+    # Handle photoatomic data
+    if args.photon is not None:
+        jobs.append((convert_photon, [args.photon], (args.photon,) + options))
+
+    with Pool() as pool:
+        results = convert_all(pool, jobs, args.destination, args.force)
+
+    # Register with library in the same order as before
+    library = openmc.data.DataLibrary()
+    for h5_files in results:
+        for h5_file in h5_files:
+            library.register_file(h5_file)
+
+    # Write cross_sections.xml
+    library.export_to_xml(args.destination / 'cross_sections.xml')
+
+
+if __name__ == '__main__':
+    main()
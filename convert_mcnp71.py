@@ -10,81 +10,26 @@ library (e.g., eprdata14) is available, it can also be converted using the
 
 import argparse
 from collections import defaultdict
+from multiprocessing import Pool
 from pathlib import Path
 import sys
 
 import openmc.data
+from utils import convert_all, export_to_hdf5
 
 
 # Make sure Python version is sufficient
 assert sys.version_info >= (3, 6), "Python 3.6+ is required"
 
 
-
 class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
                       argparse.RawDescriptionHelpFormatter):
     pass
 
 
-parser = argparse.ArgumentParser(
-    description=__doc__,
-    formatter_class=CustomFormatter
-)
-parser.add_argument('-d', '--destination', type=Path, default=Path('mcnp_endfb71'),
-                    help='Directory to create new library in')
-parser.add_argument('--libver', choices=['earliest', 'latest'],
-                    default='earliest', help="Output HDF5 versioning. Use "
-                    "'earliest' for backwards compatibility or 'latest' for "
-                    "performance")
-parser.add_argument('-p', '--photon', type=Path,
-                    help='Path to photoatomic data library (eprdata12 or later)')
-parser.add_argument('mcnpdata', type=Path,
-                    help='Directory containing endf71x and ENDF71SaB')
-args = parser.parse_args()
-
-# Check arguments to make sure they're valid
-assert args.mcnpdata.is_dir(), 'mcnpdata argument must be a directory'
-if args.photon is not None:
-    assert args.photon.is_file(), 'photon argument must be an existing file'
-
-# Get a list of all ACE files
-endf71x = list(args.mcnpdata.glob('endf71x/*/*.7??nc'))
-endf71sab = list(args.mcnpdata.glob('ENDF71SaB/*.??t'))
-
-# Check for fixed H1 files and remove old ones if present
-hydrogen = args.mcnpdata / 'endf71x' / 'H'
-if (hydrogen / '1001.720nc').is_file():
-    for i in range(10, 17):
-        endf71x.remove(hydrogen / f'1001.7{i}nc')
-
-# There's a bug in H-Zr at 1200 K
-thermal = args.mcnpdata / 'ENDF71SaB'
-endf71sab.remove(thermal / 'h-zr.27t')
-
-# Check for updated TSL files and remove old ones if present
-checks = [
-    ('sio2', 10, range(20, 37)),
-    ('u-o2', 30, range(20, 28)),
-    ('zr-h', 30, range(20, 28))
-]
-for material, good, bad in checks:
-    if (thermal / f'{material}.{good}t').is_file():
-        for suffix in bad:
-            f = thermal / f'{material}.{suffix}t'
-            if f.is_file():
-                endf71sab.remove(f)
-
-# Group together tables for the same nuclide
-tables = defaultdict(list)
-for p in sorted(endf71x + endf71sab):
-    tables[p.stem].append(p)
-
-# Create output directory if it doesn't exist
-(args.destination / 'photon').mkdir(parents=True, exist_ok=True)
-
-library = openmc.data.DataLibrary()
-
-for name, paths in sorted(tables.items()):
+def convert_group(paths, destination, libver, compress):
+    """Convert ACE tables for one nuclide or material at several temperatures
+    into a single HDF5 file and return its path"""
     # Convert first temperature for the table
     p = paths[0]
     print(f'Converting: {p}')
@@ -102,29 +47,120 @@ for name, paths in sorted(tables.items()):
             data.add_temperature_from_ace(p, 'mcnp')
 
     # Export HDF5 file
-    h5_file = args.destination / f'{data.name}.h5'
+    h5_file = destination / f'{data.name}.h5'
     print(f'Writing {h5_file}...')
-    data.export_to_hdf5(h5_file, 'w', libver=args.libver)
+    export_to_hdf5(data, h5_file, libver, compress)
+    return h5_file
 
-    # Register with library
-    library.register_file(h5_file)
 
-# Handle photoatomic data
-if args.photon is not None:
-    lib = openmc.data.ace.Library(args.photon)
+def convert_photon(path, destination, libver, compress):
+    """Convert all photoatomic tables in an ACE library file into HDF5 files
+    and return their paths"""
+    lib = openmc.data.ace.Library(path)
 
+    h5_files = []
     for table in lib.tables:
-        # Convert first temperature for the table
         print(f'Converting: {table.name}')
         data = openmc.data.IncidentPhoton.from_ace(table)
 
         # Export HDF5 file
-        h5_file = args.destination / 'photon' / f'{data.name}.h5'
+        h5_file = destination / 'photon' / f'{data.name}.h5'
         print(f'Writing {h5_file}...')
-        data.export_to_hdf5(h5_file, 'w', libver=args.libver)
-
-        # Register with library
+        export_to_hdf5(data, h5_file, libver, compress)
+        h5_files.append(h5_file)
+    return h5_files
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=CustomFormatter
+    )
+    parser.add_argument('-d', '--destination', type=Path, default=Path('mcnp_endfb71'),
+                        help='Directory to create new library in')
+    parser.add_argument('--libver', choices=['earliest', 'latest'],
+                        default='latest', help="Output HDF5 versioning. Use "
+                        "'earliest' for backwards compatibility or 'latest' for "
+                        "performance")
+    parser.add_argument('--compress', action='store_true',
+                        help="Store large datasets with gzip compression to "
+                        "reduce the size of the library")
+    parser.add_argument('--force', action='store_true',
+                        help="Convert all tables even if the HDF5 files from a "
+                        "previous run are newer than the source files")
+    parser.add_argument('-p', '--photon', type=Path,
+                        help='Path to photoatomic data library (eprdata12 or later)')
+    parser.add_argument('mcnpdata', type=Path,
+                        help='Directory containing endf71x and ENDF71SaB')
+    args = parser.parse_args()
+
+    # Check arguments to make sure they're valid
+    assert args.mcnpdata.is_dir(), 'mcnpdata argument must be a directory'
+    if args.photon is not None:
+        assert args.photon.is_file(), 'photon argument must be an existing file'
+
+    # Get a list of all ACE files
+    endf71x = list(args.mcnpdata.glob('endf71x/*/*.7??nc'))
+    endf71sab = list(args.mcnpdata.glob('ENDF71SaB/*.??t'))
+
+    # Check for fixed H1 files and remove old ones if present. The globs
+    # above already listed both directories, so their names are checked
+    # instead of stat'ing each candidate file.
+    hydrogen = args.mcnpdata / 'endf71x' / 'H'
+    if hydrogen / '1001.720nc' in set(endf71x):
+        old_h1 = {hydrogen / f'1001.7{i}nc' for i in range(10, 17)}
+        endf71x = [p for p in endf71x if p not in old_h1]
+
+    # Check for updated TSL files and remove old ones if present
+    thermal_names = {p.name for p in endf71sab}
+    checks = [
+        ('sio2', 10, range(20, 37)),
+        ('u-o2', 30, range(20, 28)),
+        ('zr-h', 30, range(20, 28))
+    ]
+    exclude = set()
+    for material, good, bad in checks:
+        if f'{material}.{good}t' in thermal_names:
+            exclude.update(f'{material}.{suffix}t' for suffix in bad)
+
+    # There's a bug in H-Zr at 1200 K
+    exclude.add('h-zr.27t')
+    endf71sab = [p for p in endf71sab if p.name not in exclude]
+
+    # Group together tables for the same nuclide. Only the tables within each
+    # group need to be in order; the groups themselves are sorted below.
+    tables = defaultdict(list)
+    for p in endf71x + endf71sab:
+        tables[p.stem].append(p)
+    for paths in tables.values():
+        paths.sort()
+
+    # Create output directory if it doesn't exist
+    (args.destination / 'photon').mkdir(parents=True, exist_ok=True)
+
+    # Convert tables in parallel. The photoatomic library holds many tables and
+    # is converted in a single worker, so it is submitted first to keep it
+    # from finishing long after the neutron tables.
+    options = (args.destination, args.libver, args.compress)
+    jobs = [(convert_group, paths, (paths,) + options)
+            for _, paths in sorted(tables.items())]
+    if args.photon is not None:
+        jobs.insert(0, (convert_photon, [args.photon], (args.photon,) + options))
+
+    with Pool() as pool:
+        h5_files = convert_all(pool, jobs, args.destination, args.force)
+
+    # Register files with the library once all conversions are done, with the
+    # photoatomic tables after the neutron tables
+    if args.photon is not None:
+        h5_files = h5_files[1:] + h5_files[0]
+    library = openmc.data.DataLibrary()
+    for h5_file in h5_files:
         library.register_file(h5_file)
 
-# Write cross_sections.xml
-library.export_to_xml(args.destination / 'cross_sections.xml')
+    # Write cross_sections.xml
+    library.export_to_xml(args.destination / 'cross_sections.xml')
+
+
+if __name__ == '__main__':
+    main()
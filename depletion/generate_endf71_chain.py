@@ -1,12 +1,13 @@
 #!/usr/bin/env python3
 
+from multiprocessing import Pool
 import os
 from pathlib import Path
-from zipfile import ZipFile
 
+import openmc.data
 import openmc.deplete
 
-from utils import download
+from utils import download, extract_zip, pipeline, prefetch
 
 
 URLS = [
@@ -22,11 +23,11 @@ def main():
     elif all(os.path.isdir(lib) for lib in ("neutrons", "decay", "nfy")):
         endf_dir = Path(".")
     else:
-        for url in URLS:
-            basename = download(url)
-            with ZipFile(basename, 'r') as zf:
-                print('Extracting {}...'.format(basename))
-                zf.extractall()
+        # Download in a background thread so that each archive can be
+        # extracted while the next one is still downloading
+        for basename in pipeline(download, URLS):
+            print('Extracting {}...'.format(basename))
+            extract_zip(basename)
         endf_dir = Path(".")
 
     decay_files = list((endf_dir / "decay").glob("*endf"))
@@ -43,7 +44,17 @@ def main():
         if not flist:
             raise IOError("No {} endf files found in {}".format(ftype, endf_dir))
 
-    chain = openmc.deplete.Chain.from_endf(decay_files, nfy_files, neutron_files)
+    # Start reading all of the evaluations into the page cache in the
+    # background, since Chain.from_endf parses them one after another
+    prefetch(decay_files + nfy_files + neutron_files)
+
+    # Chain.from_endf reads the files one after another. Decay and FPY data can
+    # be passed as evaluations instead of paths, so read those in parallel.
+    with Pool() as pool:
+        decay_evals = pool.map(openmc.data.endf.Evaluation, decay_files)
+        nfy_evals = pool.map(openmc.data.endf.Evaluation, nfy_files)
+
+    chain = openmc.deplete.Chain.from_endf(decay_evals, nfy_evals, neutron_files)
     chain.export_to_xml('chain_endfb71.xml')
 
 
@@ -1,28 +1,21 @@
 #!/usr/bin/env python3
 
+from argparse import ArgumentParser
+from functools import partial
 import glob
 import os
-from zipfile import ZipFile
-from collections import OrderedDict, defaultdict
+from collections import defaultdict
 from io import StringIO
-from itertools import chain
-
-try:
-    import lxml.etree as ET
-    _have_lxml = True
-except ImportError:
-    import xml.etree.ElementTree as ET
-    _have_lxml = False
+from multiprocessing import Pool
 
 import openmc.data
+from openmc.data import ATOMIC_SYMBOL
 import openmc.deplete
-from openmc._xml import clean_indentation
 from openmc.deplete.chain import REACTIONS, replace_missing_fpy
-from openmc.deplete.nuclide import Nuclide, DecayTuple, ReactionTuple, \
-    FissionYieldDistribution
+from openmc.deplete.nuclide import Nuclide, FissionYieldDistribution
 
 from casl_chain import CASL_CHAIN, UNMODIFIED_DECAY_BR
-from utils import download
+from utils import cached_call, download, extract_zip, pipeline
 
 URLS = [
     'https://www.nndc.bnl.gov/endf-b7.1/zips/ENDF-B-VII.1-neutrons.zip',
@@ -31,17 +24,24 @@ URLS = [
 ]
 
 
-def replace_missing_decay_product(product, decay_data, all_decay_data):
-    # Determine atomic number, mass number, and metastable state
-    Z, A, state = openmc.data.zam(product)
-    symbol = openmc.data.ATOMIC_SYMBOL[Z]
+def replace_missing_decay_product(product, decay_data, all_decay_data,
+                                  replacements=None):
+    # Nuclides visited on the way, which all share the same replacement
+    visited = []
 
     # Iterate until we find an existing nuclide in the chain
     while product not in decay_data:
-        # If product has no decay data in the library, nothing further can be done
-        if product not in all_decay_data:
+        # Reuse the replacement found when walking through here before
+        if replacements is not None and product in replacements:
+            product = replacements[product]
+            break
+
+        # If product has no decay data in the library or the decay modes lead
+        # back to a nuclide already visited, nothing further can be done
+        if product not in all_decay_data or product in visited:
             product = None
             break
+        visited.append(product)
 
         # If the current product is not in the chain but is stable, there's
         # nothing further we can do. Also, we only want to continue down the
@@ -55,20 +55,43 @@ def replace_missing_decay_product(product, decay_data, all_decay_data):
         dominant_mode = max(decay_obj.modes, key=lambda x: x.branching_ratio)
         product = dominant_mode.daughter
 
+    if replacements is not None:
+        for nuc in visited:
+            replacements[nuc] = product
     return product
 
 
+def reaction_q_values(path):
+    """Return the name of the target in an ENDF neutron sub-library file and a
+    dictionary mapping each reaction MT to its Q value"""
+    evaluation = openmc.data.endf.Evaluation(path)
+    q_values = {}
+    for mf, mt, nc, mod in evaluation.reaction_list:
+        # Q value for each reaction is given in MF=3
+        if mf == 3:
+            file_obj = StringIO(evaluation.section[3, mt])
+            openmc.data.endf.get_head_record(file_obj)
+            q_values[mt] = openmc.data.endf.get_cont_record(file_obj)[1]
+    return evaluation.gnd_name, q_values
+
+
 def main():
+    parser = ArgumentParser()
+    parser.add_argument('--cache-dir', default=None,
+                        help='Directory in which to cache parsed ENDF data so '
+                        'that unchanged files are not parsed again on later runs')
+    args = parser.parse_args()
+
     if os.path.isdir('./decay') and os.path.isdir('./nfy') and os.path.isdir('./neutrons'):
         endf_dir = '.'
     elif 'OPENMC_ENDF_DATA' in os.environ:
         endf_dir = os.environ['OPENMC_ENDF_DATA']
     else:
-        for url in URLS:
-            basename = download(url)
-            with ZipFile(basename, 'r') as zf:
-                print('Extracting {}...'.format(basename))
-                zf.extractall()
+        # Download in a background thread so that each archive can be
+        # extracted while the next one is still downloading
+        for basename in pipeline(download, URLS):
+            print('Extracting {}...'.format(basename))
+            extract_zip(basename)
         endf_dir = '.'
 
     decay_files = glob.glob(os.path.join(endf_dir, 'decay', '*.endf'))
@@ -80,49 +103,66 @@ def main():
 
     print('Reading ENDF nuclear data from "{}"...'.format(os.path.abspath(endf_dir)))
 
-    # Create dictionary mapping target to filename
-    print('Processing neutron sub-library files...')
-    reactions = {}
-    for f in neutron_files:
-        evaluation = openmc.data.endf.Evaluation(f)
-        nuc_name = evaluation.gnd_name
-        if nuc_name in CASL_CHAIN:
-            reactions[nuc_name] = {}
-            for mf, mt, nc, mod in evaluation.reaction_list:
-                # Q value for each reaction is given in MF=3
-                if mf == 3:
-                    file_obj = StringIO(evaluation.section[3, mt])
-                    openmc.data.endf.get_head_record(file_obj)
-                    q_value = openmc.data.endf.get_cont_record(file_obj)[1]
-                    reactions[nuc_name][mt] = q_value
-
-    # Determine what decay and FPY nuclides are available
-    print('Processing decay sub-library files...')
-    decay_data = {}
-    all_decay_data = {}
-    for f in decay_files:
-        decay_obj = openmc.data.Decay(f)
-        nuc_name = decay_obj.nuclide['name']
-        all_decay_data[nuc_name] = decay_obj
-        if nuc_name in CASL_CHAIN:
-            decay_data[nuc_name] = decay_obj
-
-    for nuc_name in CASL_CHAIN:
-        if nuc_name not in decay_data:
-            print('WARNING: {} has no decay data!'.format(nuc_name))
-
-    print('Processing fission product yield sub-library files...')
-    fpy_data = {}
-    for f in fpy_files:
-        fpy_obj = openmc.data.FissionProductYields(f)
-        name = fpy_obj.nuclide['name']
-        if name in CASL_CHAIN:
-            fpy_data[name] = fpy_obj
+    # Each file is parsed independently, so all three sub-libraries are read in
+    # parallel. Only the Q values are sent back for the neutron files.
+    def load(func):
+        return partial(cached_call, args.cache_dir, func)
+
+    with Pool() as pool:
+        neutron_results = pool.map_async(load(reaction_q_values), neutron_files)
+        decay_results = pool.map_async(load(openmc.data.Decay), decay_files)
+        fpy_results = pool.map_async(
+            load(openmc.data.FissionProductYields), fpy_files)
+
+        # Create dictionary mapping target to Q values
+        print('Processing neutron sub-library files...')
+        reactions = {}
+        for nuc_name, q_values in neutron_results.get():
+            if nuc_name in CASL_CHAIN:
+                reactions[nuc_name] = q_values
+
+        # Determine what decay and FPY nuclides are available
+        print('Processing decay sub-library files...')
+        decay_data = {}
+        all_decay_data = {}
+        for decay_obj in decay_results.get():
+            nuc_name = decay_obj.nuclide['name']
+            all_decay_data[nuc_name] = decay_obj
+            if nuc_name in CASL_CHAIN:
+                decay_data[nuc_name] = decay_obj
+
+        for nuc_name in CASL_CHAIN:
+            if nuc_name not in decay_data:
+                print('WARNING: {} has no decay data!'.format(nuc_name))
+
+        print('Processing fission product yield sub-library files...')
+        fpy_data = {}
+        for fpy_obj in fpy_results.get():
+            name = fpy_obj.nuclide['name']
+            if name in CASL_CHAIN:
+                fpy_data[name] = fpy_obj
 
     print('Creating depletion_chain...')
+
+    # Fission products in the chain along with how their yields are determined.
+    # Looking these up in each yield table is much cheaper than scanning the
+    # ~1000 products present in every table.
+    fission_products = [
+        (product, CASL_CHAIN[product][2], CASL_CHAIN[product][3])
+        for product in decay_data if CASL_CHAIN[product][2] in (1, 2, 3)
+    ]
+
     missing_daughter = []
     missing_rx_product = []
     missing_fpy = []
+    replacements = {}
+
+    # Transmutation reactions to list for each nuclide, along with their MTs in
+    # sorted order so that summation reactions (e.g., MT=103) come first
+    transmutation_reactions = []
+    for name in ('(n,2n)', '(n,3n)', '(n,4n)', '(n,gamma)', '(n,p)', '(n,a)'):
+        mts, changes, _ = REACTIONS[name]
+        transmutation_reactions.append((name, mts, sorted(mts), changes))
 
     for idx, parent in enumerate(sorted(decay_data, key=openmc.data.zam)):
         data = decay_data[parent]
@@ -161,29 +201,28 @@ def main():
         # If nuclide has incident neutron data, we need to list what
         # transmutation reactions are possible
         fissionable = False
-        transmutation_reactions = ('(n,2n)', '(n,3n)', '(n,4n)', '(n,gamma)',
-                                   '(n,p)', '(n,a)')
         if parent in reactions:
-            reactions_available = reactions[parent].keys()
-            for name in transmutation_reactions:
-                mts, changes, _ = REACTIONS[name]
-                if mts & reactions_available:
+            q_values = reactions[parent]
+            A_parent = data.nuclide['mass_number']
+            Z_parent = data.nuclide['atomic_number']
+            for name, mts, sorted_mts, changes in transmutation_reactions:
+                if not mts.isdisjoint(q_values):
                     delta_A, delta_Z = changes
-                    A = data.nuclide['mass_number'] + delta_A
-                    Z = data.nuclide['atomic_number'] + delta_Z
-                    daughter = '{}{}'.format(openmc.data.ATOMIC_SYMBOL[Z], A)
+                    A = A_parent + delta_A
+                    Z = Z_parent + delta_Z
+                    daughter = f'{ATOMIC_SYMBOL[Z]}{A}'
 
                     if daughter not in decay_data:
                         daughter = replace_missing_decay_product(
-                            daughter, decay_data, all_decay_data)
+                            daughter, decay_data, all_decay_data, replacements)
                         if daughter is None:
                             missing_rx_product.append((parent, name, daughter))
 
                     # Store Q value -- use sorted order so we get summation
                     # reactions (e.g., MT=103) first
-                    for mt in sorted(mts):
-                        if mt in reactions[parent]:
-                            q_value = reactions[parent][mt]
+                    for mt in sorted_mts:
+                        if mt in q_values:
+                            q_value = q_values[mt]
                             break
                     else:
                         q_value = 0.0
@@ -191,8 +230,8 @@ def main():
                     nuclide.add_reaction(name, daughter, q_value, 1.0)
 
             # Check for fission reactions
-            if any(mt in reactions_available for mt in [18, 19, 20, 21, 38]):
-                q_value = reactions[parent][18]
+            if any(mt in q_values for mt in [18, 19, 20, 21, 38]):
+                q_value = q_values[18]
                 nuclide.add_reaction('fission', None, q_value, 1.0)
                 fissionable = True
 
@@ -212,32 +251,28 @@ def main():
             yield_data = {}
             for E, table_yd, table_yc in zip(yield_energies, fpy.independent, fpy.cumulative):
                 yields = defaultdict(float)
-                for product in table_yd:
-                    if product in decay_data:
-                        # identifier
-                        ifpy = CASL_CHAIN[product][2]
-                        # 1 for independent
-                        if ifpy == 1:
-                            if product not in table_yd:
-                                print('No independent fission yields found for {} in {}'.format(product, parent))
-                            else:
-                                yields[product] += table_yd[product].nominal_value
-                        # 2 for cumulative
-                        elif ifpy == 2:
-                            if product not in table_yc:
-                                print('No cumulative fission yields found for {} in {}'.format(product, parent))
+                for product, ifpy, special in fission_products:
+                    if product not in table_yd:
+                        continue
+                    # 1 for independent
+                    if ifpy == 1:
+                        yields[product] += table_yd[product].nominal_value
+                    # 2 for cumulative
+                    elif ifpy == 2:
+                        if product not in table_yc:
+                            print('No cumulative fission yields found for {} in {}'.format(product, parent))
+                        else:
+                            yields[product] += table_yc[product].nominal_value
+                    # 3 for special treatment with weight fractions
+                    elif ifpy == 3:
+                        for name_i, weight_i, ifpy_i in special:
+                            if name_i not in table_yd:
+                                print('No fission yields found for {} in {}'.format(name_i, parent))
                             else:
-                                yields[product] += table_yc[product].nominal_value
-                        # 3 for special treatment with weight fractions
-                        elif ifpy == 3:
-                            for name_i, weight_i, ifpy_i in CASL_CHAIN[product][3]:
-                                if name_i not in table_yd:
-                                    print('No fission yields found for {} in {}'.format(name_i, parent))
-                                else:
-                                    if ifpy_i == 1:
-                                        yields[product] += weight_i * table_yd[name_i].nominal_value
-                                    elif ifpy_i == 2:
-                                        yields[product] += weight_i * table_yc[name_i].nominal_value
+                                if ifpy_i == 1:
+                                    yields[product] += weight_i * table_yd[name_i].nominal_value
+                                elif ifpy_i == 2:
+                                    yields[product] += weight_i * table_yc[name_i].nominal_value
 
                 yield_data[E] = yields
 
@@ -5,34 +5,68 @@ Determine Q values equivalent to the defaults in Serpent
 """
 
 from argparse import ArgumentParser
+from functools import partial
+from io import StringIO
+from multiprocessing import Pool
 from pathlib import Path
 import json
 
 import openmc.data
 
-# Get command line argument
-parser = ArgumentParser()
-parser.add_argument('dir', type=Path, help='Directory containing ENDF neutron sublibrary files')
-args = parser.parse_args()
-
-# Get Q value for U235
-u235 = openmc.data.IncidentNeutron.from_endf(args.dir / 'n-092_U_235.endf')
-q_u235 = u235[18].q_value
-
-# Fixed heating value from Serpent
-# See http://serpent.vtt.fi/mediawiki/index.php/Input_syntax_manual#set_fissh
-heat_u235 = 202.27e6
-
-# Get Q values for all fissionable nuclides and scale by the ratio of the U235 Q
-# value and heating value
-serpent_fission_q = {}
-for path in args.dir.glob('*.endf'):
-    nuc = openmc.data.IncidentNeutron.from_endf(path)
-    if nuc.fission_energy is None:
-        continue
-    q = nuc[18].q_value
-    serpent_fission_q[nuc.name] = heat_u235 * q / q_u235
-
-# Write heating values to JSON file
-with open('serpent_fissq.json', 'w') as f:
-    json.dump(serpent_fission_q, f, indent=2)
+from utils import cached_call
+
+
+def fission_q_value(path):
+    """Return the name of the nuclide in an ENDF neutron sublibrary file and its
+    fission Q value, or None if it isn't fissionable
+
+    Only the MF=3, MT=18 section is read rather than building a full
+    IncidentNeutron, which would process every reaction in the file.
+    """
+    ev = openmc.data.endf.Evaluation(path)
+
+    # Fissionable nuclides are those with fission energy release data
+    if (1, 458) not in ev.section or (3, 18) not in ev.section:
+        return ev.gnd_name, None
+
+    # Q value is given in the TAB1 record of MF=3
+    file_obj = StringIO(ev.section[3, 18])
+    openmc.data.endf.get_head_record(file_obj)
+    q = openmc.data.endf.get_cont_record(file_obj)[1]
+    return ev.gnd_name, q
+
+
+def main():
+    # Get command line argument
+    parser = ArgumentParser()
+    parser.add_argument('dir', type=Path, help='Directory containing ENDF neutron sublibrary files')
+    parser.add_argument('--cache-dir', type=Path, default=None,
+                        help='Directory in which to cache fission Q values so that '
+                        'unchanged files are not parsed again on later runs')
+    args = parser.parse_args()
+
+    # Get Q values for all fissionable nuclides
+    with Pool() as pool:
+        results = pool.map(partial(cached_call, args.cache_dir, fission_q_value),
+                           sorted(args.dir.glob('*.endf')))
+    fission_q = {name: q for name, q in results if q is not None}
+
+    # Get Q value for U235
+    q_u235 = fission_q['U235']
+
+    # Fixed heating value from Serpent
+    # See http://serpent.vtt.fi/mediawiki/index.php/Input_syntax_manual#set_fissh
+    heat_u235 = 202.27e6
+
+    # Scale Q values by the ratio of the U235 Q value and heating value
+    serpent_fission_q = {
+        name: heat_u235 * q / q_u235 for name, q in fission_q.items()
+    }
+
+    # Write heating values to JSON file
+    with open('serpent_fissq.json', 'w') as f:
+        json.dump(serpent_fission_q, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
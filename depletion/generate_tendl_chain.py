@@ -9,15 +9,14 @@ library should be used for decay and FPY evaluations and defaults to JEFF 3.3.
 
 from argparse import ArgumentParser
 import json
+from multiprocessing import Pool
 import os
 from pathlib import Path
-import tarfile
-from zipfile import ZipFile
 
 import openmc.deplete as dep
 import openmc.data
 
-from utils import download
+from utils import download, extract_tar, extract_zip
 
 
 NEUTRON_LIB = 'https://tendl.web.psi.ch/tendl_2019/tar_files/TENDL-n.tgz'
@@ -32,17 +31,15 @@ NFY_LIB = {
 
 
 def extract(filename, path=".", verbose=True):
-    # Determine function to open archive
+    if verbose:
+        print(f'Extracting {filename}...')
+
+    # ZIP members are inflated by several threads at once, and gzipped tarballs
+    # are decompressed by pigz when it is available
     if Path(filename).suffix == '.zip':
-        func = ZipFile
+        extract_zip(filename, path)
     else:
-        func = tarfile.open
-
-    # Open archive and extract files
-    with func(filename, 'r') as fh:
-        if verbose:
-            print(f'Extracting {filename}...')
-        fh.extractall(path)
+        extract_tar(filename, path)
 
 
 def fix_jeff33_nfy(path):
@@ -81,11 +78,13 @@ def main():
     with open('tendl2019_nuclides.json', 'r') as fh:
         transport_nuclides = set(json.load(fh))
 
-    neutron_files = [
-        p
-        for p in (endf_dir / "neutrons").glob("*.tendl")
-        if p.name[2:-6] in transport_nuclides  # filename is n-XXNNN.tendl
-    ]
+    with os.scandir(neutron_dir) as entries:
+        neutron_files = [
+            entry.path
+            for entry in entries
+            # filename is n-XXNNN.tendl
+            if entry.name.endswith('.tendl') and entry.name[2:-6] in transport_nuclides
+        ]
 
     # ==========================================================================
     # Decay and fission product yield data
@@ -106,6 +105,13 @@ def main():
         extract(nfy_file, nfy_dir)
         nfy_files = list(nfy_dir.rglob('*.endf'))
 
+    # Chain.from_endf reads the files one after another. Decay and FPY data can
+    # be passed as evaluations instead of paths, so read those in parallel.
+    with Pool() as pool:
+        decay_files = pool.map(openmc.data.endf.Evaluation, decay_files)
+        if args.lib == 'endf80':
+            nfy_files = pool.map(openmc.data.endf.Evaluation, nfy_files)
+
     chain = dep.Chain.from_endf(
         decay_files, nfy_files, neutron_files,
         reactions=dep.chain.REACTIONS.keys()
@@ -6,14 +6,14 @@ and convert it to a HDF5 library for use with OpenMC.
 """
 
 import argparse
-import zipfile
+import re
 from multiprocessing import Pool
 from pathlib import Path
 from shutil import rmtree
 from urllib.parse import urljoin
 
 import openmc.data
-from utils import download, process_neutron
+from utils import download, endf_awr, extract_zip, find_files, process_neutron
 
 
 class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
@@ -70,16 +70,16 @@ def main():
         '3.1': {
             'base_url': 'https://www.oecd-nea.org/dbforms/data/eva/evatapes/cendl_31/',
             'compressed_files': ['CENDL-31.zip'],
-            'neutron_files': endf_files_dir.glob('*.C31'),
-            'metastables': endf_files_dir.glob('*m.C31'),
+            'neutron_files': '*.C31',
+            'metastables': '*m.C31',
             'compressed_file_size': '0.03 GB',
             'uncompressed_file_size': '0.4 GB'
         },
         '3.2': {
         'base_url': 'http://www.nuclear.csdb.cn/endf/CENDL/',
         'compressed_files': ['n-CENDL-3.2.zip'],
-        'neutron_files': endf_files_dir.glob('n-CENDL-3.2/CENDL-3.2/*.C32'),
-        'metastables': endf_files_dir.glob('n-CENDL-3.2/CENDL-3.2/*m.C32'),
+        'neutron_files': 'n-CENDL-3.2/CENDL-3.2/*.C32',
+        'metastables': 'n-CENDL-3.2/CENDL-3.2/*m.C32',
         'compressed_file_size': '0.11 GB',
         'uncompressed_file_size': '0.41 GB'
         }
@@ -106,9 +106,8 @@ def main():
     # EXTRACT FILES FROM ZIP
     if args.extract:
         for f in release_details[args.release]['compressed_files']:
-            with zipfile.ZipFile(download_path / f) as zf:
-                print('Extracting {0}...'.format(f))
-                zf.extractall(path=endf_files_dir)
+            print('Extracting {0}...'.format(f))
+            extract_zip(download_path / f, endf_files_dir)
 
         if args.cleanup and download_path.exists():
             rmtree(download_path)
@@ -117,28 +116,46 @@ def main():
     # GENERATE HDF5 LIBRARY -- NEUTRON FILES
 
     # Get a list of all ENDF files
-    neutron_files = release_details[args.release]['neutron_files']
+    details = release_details[args.release]
+    neutron_files = find_files(endf_files_dir, {
+        'neutron_files': details['neutron_files']
+    })['neutron_files']
 
     # Create output directory if it doesn't exist
     args.destination.mkdir(parents=True, exist_ok=True)
 
     library = openmc.data.DataLibrary()
 
+    # this is a fix for the CENDL 3.1 release where the 22-Ti-047.C31 and
+    # 5-B-010.C31 files contain non-ASCII characters. Each comment card is
+    # located by its MAT/MF/MT/line number columns and replaced in place.
+    if args.release == '3.1':
+        line_fixes = {
+            '22-Ti-047.C31': (
+                rb'^[^\n]*2228 1451  205',
+                b' 8) YUAN Junqian,WANG Yongchang,etc.               ,16,(1),57,92012228 1451  205'
+            ),
+            '5-B-010.C31': (
+                rb'^[^\n]* 525 1451  203',
+                b'21)   Day R.B. and Walt M.  Phys.rev.117,1330 (1960)               525 1451  203'
+            )
+        }
+        for filename in neutron_files:
+            if filename.name in line_fixes:
+                print('Manual fix for incorrect value in ENDF file')
+                pattern, line = line_fixes[filename.name]
+                data = re.sub(pattern, line, filename.read_bytes(), count=1,
+                              flags=re.M)
+                # Drop any other bytes that aren't valid UTF-8 as well
+                data = data.decode('utf-8', 'ignore').encode()
+                filename.write_bytes(data)
+
     with Pool() as pool:
         results = []
-        for filename in sorted(neutron_files):
-
-            # this is a fix for the CENDL 3.1 release where the
-            # 22-Ti-047.C31 and 5-B-010.C31 files contain non-ASCII characters
-            if library_name == 'cendl' and args.release == '3.1' and filename.name in ['22-Ti-047.C31', '5-B-010.C31']:
-                print('Manual fix for incorrect value in ENDF file')
-                text = open(filename, 'rb').read().decode('utf-8', 'ignore').split('\r\n')
-                if filename.name == '22-Ti-047.C31':
-                    text[205] = ' 8) YUAN Junqian,WANG Yongchang,etc.               ,16,(1),57,92012228 1451  205'
-                if filename.name == '5-B-010.C31':
-                    text[203] = '21)   Day R.B. and Walt M.  Phys.rev.117,1330 (1960)               525 1451  203'
-                open(filename, 'w').write('\r\n'.join(text))
 
+        # Submit the heaviest nuclides first so that the longest NJOY runs
+        # don't end up starting last
+        for filename in sorted(neutron_files, key=endf_awr, reverse=True):
             func_args = (filename, args.destination, args.libver)
             r = pool.apply_async(process_neutron, func_args)
             results.append(r)
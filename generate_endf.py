@@ -9,14 +9,13 @@ neutron, incident photon, and thermal scattering data.
 
 import argparse
 import sys
-import tarfile
-import zipfile
 from multiprocessing import Pool
 from pathlib import Path
-from shutil import rmtree, copy, copyfileobj
+from shutil import rmtree, copy
 
 import openmc.data
-from utils import download, process_neutron, process_thermal
+from utils import (download, endf_awr, extract_tar, extract_zip, find_files,
+                   pipeline, process_neutron, process_photon, process_thermal)
 
 # Make sure Python version is sufficient
 assert sys.version_info >= (3, 6), "Python 3.6+ is required"
@@ -43,6 +42,9 @@ def main():
                         help='Extract zip files')
     parser.add_argument('--no-extract', dest='extract', action='store_false',
                         help='Do not extract zip files')
+    parser.add_argument('--force-extract', action='store_true',
+                        help='Extract all files even if they already exist '
+                        'with the expected size')
     parser.add_argument('--libver', choices=['earliest', 'latest'],
                         default='earliest', help="Output HDF5 versioning. Use "
                         "'earliest' for backwards compatibility or 'latest' for "
@@ -100,7 +102,7 @@ def main():
                 'checksums': ['e5d7f441fc4c92893322c24d1725e29c',
                             'fe590109dde63b2ec5dc228c7b8cab02'],
                 'file_type': 'endf',
-                'endf_files': neutron_dir.rglob('n-*.endf'),
+                'endf_files': '**/n-*.endf',
                 'sab_files': [
                     (neutron_dir / 'n-001_H_001.endf', neutron_dir / 'tsl-HinH2O.endf'),
                     (neutron_dir / 'n-001_H_001.endf', neutron_dir / 'tsl-HinCH2.endf'),
@@ -134,8 +136,8 @@ def main():
                 'checksums': ['5192f94e61f0b385cf536f448ffab4a4',
                             'fddb6035e7f2b6931e51a58fc754bd10'],
                 'file_type': 'endf',
-                'photo_files': endf_files_dir.joinpath('photon').rglob('photoat*.endf'),
-                'atom_files': endf_files_dir.joinpath('photon').rglob('atom*.endf'),
+                'photo_files': '**/photoat*.endf',
+                'atom_files': '**/atom*.endf',
                 'compressed_file_size': 9,
                 'uncompressed_file_size': 45
             },
@@ -157,7 +159,7 @@ def main():
                             'ecd503d3f8214f703e95e17cc947062c',
                             'eaf71eb22258f759abc205a129d8715a'],
                 'file_type': 'endf',
-                'endf_files': neutron_dir.rglob('n-*.endf'),
+                'endf_files': '**/n-*.endf',
                 'sab_files': [
                     (neutron_dir / 'n-001_H_001.endf', neutron_dir / 'tsl-HinC5O2H8.endf'),
                     (neutron_dir / 'n-001_H_001.endf', neutron_dir / 'tsl-HinH2O.endf'),
@@ -204,8 +206,8 @@ def main():
                 'checksums': ['d49f5b54be278862e1ce742ccd94f5c0',
                             '805f877c59ad22dcf57a0446d266ceea'],
                 'file_type': 'endf',
-                'photo_files': endf_files_dir.joinpath('photon').rglob('photoat*.endf'),
-                'atom_files': endf_files_dir.joinpath('photon').rglob('atom*.endf'),
+                'photo_files': '**/photoat*.endf',
+                'atom_files': '**/atom*.endf',
                 'compressed_file_size': 1.2+35,
                 'uncompressed_file_size': 999999
             }
@@ -230,68 +232,66 @@ def main():
     # ==============================================================================
     # DOWNLOAD FILES FROM NNDC SITE
 
+    # Archives for each particle in the order they need to be extracted, so that
+    # erratafiles overwrite the originals
+    archives = [
+        (particle, i, f)
+        for particle in args.particles
+        for i, f in enumerate(release_details[args.release][particle]['compressed_files'])
+    ]
+
+    def download_file(archive):
+        particle, i, f = archive
+        details = release_details[args.release][particle]
+        url = details['base_url'] + f
+        if 'checksums' in details.keys():
+            checksum = details['checksums'][i]
+            download(url, output_path=download_path / particle, checksum=checksum)
+        else:
+            download(url, output_path=download_path / particle)
+        return archive
+
     if args.download:
         print(download_warning)
-        for particle in args.particles:
-            details = release_details[args.release][particle]
-            for i, f in enumerate(details['compressed_files']):
-                url = details['base_url'] + f
-                if 'checksums' in details.keys():
-                    checksum = details['checksums'][i]
-                    downloaded_file = download(url,
-                                            output_path=download_path / particle,
-                                            checksum=checksum)
-                else:
-                    downloaded_file = download(url,
-                                            output_path=download_path / particle,
-                                            )
+        # Download in a background thread so that each file can be extracted while
+        # the next one is still downloading
+        archives = pipeline(download_file, archives)
 
     # ==============================================================================
     # EXTRACT FILES FROM TGZ
 
-    if args.extract:
-        for particle in args.particles:
-
-            if release_details[args.release][particle]['file_type'] == 'wmp':
-                extraction_dir = args.destination / particle
-            elif release_details[args.release][particle]['file_type'] == 'endf':
-                extraction_dir = endf_files_dir / particle
-            Path.mkdir(extraction_dir, parents=True, exist_ok=True)
-
-            for f in release_details[args.release][particle]['compressed_files']:
-                fname = Path(f).name
-                # Extract files different depending on compression method
-                if fname.endswith('.zip'):
-                    print(f'Extracting {fname}...')
-                    with zipfile.ZipFile(download_path / particle / fname) as zipf:
-                        # Extracts files without folder structure in the zip file
-                        for member in zipf.namelist():
-                            filename = Path(member).name
-                            # skip directories
-                            if not filename:
-                                continue
-                            source = zipf.open(member)
-                            target = open(extraction_dir / filename, "wb")
-                            with source, target:
-                                copyfileobj(source, target)
-                elif fname.endswith('.tar.gz'):
-                    with tarfile.open(download_path / particle / fname, 'r') as tgz:
-                        print(f'Extracting {fname}...')
-                        # extract files ignoring the internal folder structure
-                        for member in tgz.getmembers():
-                            if member.isreg():
-                                member.name = Path(member.name).name
-                                tgz.extract(member, path=extraction_dir)
-                else:
-                    # File is not compressed. Used for erratafiles. This ensures
-                    # the n-005_B_010.endf erratafile overwrites the orginal
-                    copy(download_path/particle/fname, extraction_dir/fname)
-
-        if args.cleanup and download_path.exists():
-            rmtree(download_path)
+    for particle, _, f in archives:
+        if not args.extract:
+            continue
+
+        if release_details[args.release][particle]['file_type'] == 'wmp':
+            extraction_dir = args.destination / particle
+        elif release_details[args.release][particle]['file_type'] == 'endf':
+            extraction_dir = endf_files_dir / particle
+        Path.mkdir(extraction_dir, parents=True, exist_ok=True)
+
+        fname = Path(f).name
+        # Extract files different depending on compression method
+        if fname.endswith('.zip'):
+            print(f'Extracting {fname}...')
+            # Extracts files without folder structure in the zip file
+            extract_zip(download_path / particle / fname, extraction_dir,
+                        flatten=True, skip_existing=not args.force_extract)
+        elif fname.endswith('.tar.gz'):
+            print(f'Extracting {fname}...')
+            # extract files ignoring the internal folder structure
+            extract_tar(download_path / particle / fname, extraction_dir,
+                        flatten=True, skip_existing=not args.force_extract)
+        else:
+            # File is not compressed. Used for erratafiles. This ensures
+            # the n-005_B_010.endf erratafile overwrites the orginal
+            copy(download_path/particle/fname, extraction_dir/fname)
+
+    if args.extract and args.cleanup and download_path.exists():
+        rmtree(download_path)
 
     # =========================================================================
-    # PROCESS INCIDENT NEUTRON AND THERMAL SCATTERING DATA IN PARALLEL
+    # PROCESS INCIDENT NEUTRON, THERMAL SCATTERING AND PHOTON DATA IN PARALLEL
 
     # Create output directory if it doesn't exist
     for particle in args.particles:
@@ -300,12 +300,20 @@ def main():
 
     library = openmc.data.DataLibrary()
 
-    if 'neutron' in args.particles:
-        particle = 'neutron'
-        with Pool() as pool:
+    # Incident photon data is converted in the same pool so that it runs while
+    # the heaviest neutron evaluations are still being processed by NJOY
+    with Pool() as pool:
+        neutron_results = []
+        if 'neutron' in args.particles:
+            particle = 'neutron'
             details = release_details[args.release][particle]
-            results = []
-            for filename in details['endf_files']:
+            endf_files = find_files(neutron_dir, {
+                'endf_files': details['endf_files']
+            })['endf_files']
+
+            # Submit the heaviest nuclides first so that the longest NJOY runs
+            # don't end up starting last
+            for filename in sorted(endf_files, key=endf_awr, reverse=True):
 
                 # Skip neutron evaluation that fails the processing stage
                 if filename.name == 'n-000_n_001.endf':
@@ -314,39 +322,44 @@ def main():
                 func_args = (filename, args.destination / particle, args.libver,
                             args.temperatures)
                 r = pool.apply_async(process_neutron, func_args)
-                results.append(r)
+                neutron_results.append(r)
 
-            for path_neutron, path_thermal in details['sab_files']:
+            sab_files = sorted(details['sab_files'], reverse=True,
+                               key=lambda paths: paths[1].stat().st_size)
+            for path_neutron, path_thermal in sab_files:
                 func_args = (path_neutron, path_thermal,
                             args.destination / particle, args.libver)
                 r = pool.apply_async(process_thermal, func_args)
-                results.append(r)
+                neutron_results.append(r)
 
-            for r in results:
-                r.wait()
+        # =====================================================================
+        # INCIDENT PHOTON DATA
 
-        for p in sorted((args.destination / particle).glob('*.h5'), key=sort_key):
+        photon_results = []
+        if 'photon' in args.particles:
+            particle = 'photon'
+            details = release_details[args.release][particle]
+            photon_files = find_files(endf_files_dir / particle, {
+                'photo_files': details['photo_files'],
+                'atom_files': details['atom_files']
+            })
+            for photo_path, atom_path in zip(photon_files['photo_files'],
+                                             photon_files['atom_files']):
+                func_args = (photo_path, atom_path, args.destination / particle,
+                             args.libver)
+                r = pool.apply_async(process_photon, func_args)
+                photon_results.append(r)
+
+        for r in neutron_results:
+            r.wait()
+        photon_h5_files = [r.get() for r in photon_results]
+
+    # Register with library
+    if 'neutron' in args.particles:
+        for p in sorted((args.destination / 'neutron').glob('*.h5'), key=sort_key):
             library.register_file(p)
-
-
-    # =========================================================================
-    # INCIDENT PHOTON DATA
-
-    if 'photon' in args.particles:
-        particle = 'photon'
-        details = release_details[args.release][particle]
-        for photo_path, atom_path in zip(sorted(details['photo_files']),
-                                        sorted(details['atom_files'])):
-            # Generate instance of IncidentPhoton
-            print('Converting:', photo_path.name, atom_path.name)
-            data = openmc.data.IncidentPhoton.from_endf(photo_path, atom_path)
-
-            # Export HDF5 file
-            h5_file = args.destination / particle / f'{data.name}.h5'
-            data.export_to_hdf5(h5_file, 'w', libver=args.libver)
-
-            # Register with library
-            library.register_file(h5_file)
+    for h5_file in photon_h5_files:
+        library.register_file(h5_file)
 
     # =========================================================================
     # INCIDENT WMP NEUTRON DATA
@@ -20,7 +20,7 @@ from urllib.parse import urljoin
 
 import openmc.data
 
-from utils import download, process_neutron, process_thermal
+from utils import download, endf_awr, process_neutron, process_thermal
 
 # Make sure Python version is sufficient
 assert sys.version_info >= (3, 6), "Python 3.6+ is required"
@@ -158,12 +158,17 @@ def main():
         # PROCESS INCIDENT NEUTRON AND THERMAL SCATTERING DATA IN PARALLEL
 
         with Pool() as pool:
-            neutron_paths = neutron_dir.glob('*.jeff33')
+            # Submit the heaviest nuclides first so that the longest NJOY runs
+            # don't end up starting last
+            neutron_paths = sorted(neutron_dir.glob('*.jeff33'), key=endf_awr,
+                                   reverse=True)
             results = []
             for p in neutron_paths:
                 func_args = (p, destination, args.libver, args.temperatures)
                 r = pool.apply_async(process_neutron, func_args)
                 results.append(r)
+            thermal_paths.sort(key=lambda paths: paths[1].stat().st_size,
+                               reverse=True)
             for p_neut, p_therm in thermal_paths:
                 func_args = (p_neut, p_therm, destination, args.libver)
                 r = pool.apply_async(process_thermal, func_args)
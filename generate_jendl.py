@@ -7,7 +7,6 @@ use with OpenMC.
 
 import argparse
 import ssl
-import tarfile
 import gzip
 from multiprocessing import Pool
 from pathlib import Path
@@ -15,7 +14,7 @@ from shutil import rmtree, copyfileobj
 from urllib.parse import urljoin
 
 import openmc.data
-from utils import download, process_neutron
+from utils import download, extract_tar, pipeline, process_neutron
 
 
 class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
@@ -42,6 +41,16 @@ def main():
                         default='latest', help="Output HDF5 versioning. Use "
                         "'earliest' for backwards compatibility or 'latest' for "
                         "performance")
+    parser.add_argument('--compress', action='store_true',
+                        help="Store large datasets with gzip compression to "
+                        "reduce the size of the library")
+    parser.add_argument('--cache-dir', type=Path, default=None,
+                        help="Directory in which to cache HDF5 files so that "
+                        "unchanged evaluations are not reprocessed on later runs")
+    parser.add_argument('--scratch-dir', type=Path, default=None,
+                        help="Directory on a fast local filesystem, e.g. "
+                        "/dev/shm, in which to write HDF5 files before moving "
+                        "them to the destination")
     parser.add_argument('-r', '--release', choices=['4.0', '5.0'], default='5.0',
                         help="The nuclear data library release version. "
                         "The currently supported options are 4.0, 5.0")
@@ -72,8 +81,8 @@ def main():
         '4.0': {
             'base_url': 'https://wwwndc.jaea.go.jp/ftpnd/ftp/JENDL/',
             'compressed_files': ['jendl40-or-up_20160106.tar.gz'],
-            'endf_files': endf_files_dir.joinpath('jendl40-or-up_20160106').glob('*.dat'),
-            'metastables': endf_files_dir.joinpath('jendl40-or-up_20160106').glob('*m.dat'),
+            'endf_files': 'jendl40-or-up_20160106/*.dat',
+            'metastables': 'jendl40-or-up_20160106/*m.dat',
             'compressed_file_size': '0.2 GB',
             'uncompressed_file_size': '2 GB'
         },
@@ -82,8 +91,8 @@ def main():
             'compressed_files': ['ftp/JENDL/jendl5-n.tar.gz',
                                 'jendl/jendl5-update/data/jendl5_upd6.tar.gz',
                                 'jendl/jendl5-update/data/n_059-Pr-141.dat.gz'],
-            'endf_files': endf_files_dir.glob('*.dat'),
-            'metastables': endf_files_dir.glob('*m1.dat'),
+            'endf_files': '*.dat',
+            'metastables': '*m1.dat',
             'compressed_file_size': '4.1 GB',
             'uncompressed_file_size': '16 GB'
         }
@@ -96,58 +105,64 @@ def main():
             release_details[args.release]['uncompressed_file_size'])
 
     # ==============================================================================
-    # DOWNLOAD FILES FROM WEBSITE
+    # DOWNLOAD AND EXTRACT FILES FROM WEBSITE
 
+    def download_file(f):
+        return download(urljoin(release_details[args.release]['base_url'], f),
+                        context=ssl._create_unverified_context(),
+                        output_path=download_path, connections=4)
+
+    compressed_files = release_details[args.release]['compressed_files']
     if args.download:
         print(download_warning)
-        for f in release_details[args.release]['compressed_files']:
-            # Establish connection to URL
-            download(urljoin(release_details[args.release]['base_url'], f),
-                    context=ssl._create_unverified_context(),
-                    output_path=download_path)
-
-    # ==============================================================================
-    # EXTRACT FILES FROM TGZ
-    if args.extract:
-        for f in release_details[args.release]['compressed_files']:
-            fname = Path(f).parts[-1]
-            if fname.endswith('.tar.gz'):
-                with tarfile.open(download_path / fname, 'r') as tgz:
-                    print('Extracting {}...'.format(fname))
-                    # extract files ignoring internal folder structure
-                    for member in tgz.getmembers():
-                        if member.isreg():
-                            member.name = Path(member.name).name
-                            tgz.extract(member, path=endf_files_dir)
-
-            else:
-                # get the file name
-                filename = Path(download_path / fname)
-                source = gzip.open(filename)
-                target = open(endf_files_dir / filename.name.rsplit('.', 1)[0], 'wb')
-                with source, target:
-                    copyfileobj(source, target)
-
-        if args.cleanup and download_path.exists():
-            rmtree(download_path)
+        # Download in a background thread so that each file can be extracted
+        # while the next one is still downloading
+        local_files = pipeline(download_file, compressed_files)
+    else:
+        local_files = (download_path / Path(f).name for f in compressed_files)
+
+    for path in local_files:
+        if not args.extract:
+            continue
+
+        fname = path.name
+        if fname.endswith('.tar.gz'):
+            print('Extracting {}...'.format(fname))
+            # extract files ignoring internal folder structure
+            extract_tar(path, endf_files_dir, flatten=True)
+
+        else:
+            source = gzip.open(path)
+            target = open(endf_files_dir / fname.rsplit('.', 1)[0], 'wb')
+            with source, target:
+                copyfileobj(source, target)
+
+    if args.extract and args.cleanup and download_path.exists():
+        rmtree(download_path)
 
     # ==============================================================================
     # GENERATE HDF5 LIBRARY -- NEUTRON FILES
 
     # Get a list of all ENDF files
-    neutron_files = release_details[args.release]['endf_files']
+    neutron_files = sorted(
+        endf_files_dir.glob(release_details[args.release]['endf_files']))
 
     # Create output directory if it doesn't exist
     args.destination.mkdir(parents=True, exist_ok=True)
+    if args.scratch_dir is not None:
+        args.scratch_dir.mkdir(parents=True, exist_ok=True)
 
     library = openmc.data.DataLibrary()
 
 
     with Pool() as pool:
         results = []
-        for filename in sorted(neutron_files):
+        for filename in neutron_files:
             func_args = (filename, args.destination, args.libver)
-            r = pool.apply_async(process_neutron, func_args)
+            r = pool.apply_async(process_neutron, func_args,
+                                 {'compress': args.compress,
+                                  'cache_dir': args.cache_dir,
+                                  'scratch_dir': args.scratch_dir})
             results.append(r)
 
         for r in results:
@@ -17,7 +17,7 @@ import zipfile
 
 import openmc.data
 
-from utils import download
+from utils import download, patch_file
 
 base_ace = 'http://www.nndc.bnl.gov/endf-b7.1/aceFiles/'
 base_endf = 'http://www.nndc.bnl.gov/endf-b7.1/zips/'
@@ -33,12 +33,8 @@ files = [
 
 
 def fix_zaid(table, old, new):
-    filename = os.path.join('tsl', table)
-    with open(filename, 'r') as fh:
-        text = fh.read()
-    text = text.replace(old, new, 1)
-    with open(filename, 'w') as fh:
-        fh.write(text)
+    # Only search the IZ/AW pairs on lines 3-6 of the ACE header
+    patch_file(os.path.join('tsl', table), old, new, lines=6)
 
 
 pwd = Path.cwd()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The scripts import utils as a top-level module from the repository root
+sys.path.insert(0, str(Path(__file__).parents[1]))
@@ -0,0 +1,555 @@
+import hashlib
+import http.server
+import json
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from multiprocessing.pool import ThreadPool
+from pathlib import Path
+
+import pytest
+
+import utils
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for name in ['a.ace', 'b.acer', 'Ab.ace', 'sub/c.ace', 'sub/deep/d.ace',
+                 'sub/deep/e-n.ace', 'other/f-n.ace', 'other/g.txt']:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(name)
+    return tmp_path
+
+
+@pytest.mark.parametrize('pattern', [
+    '*.ace', '**/*.ace', '*/*.ace', '*/*/*-n.ace', 'sub/*', '**/*-n.ace',
+    '[aA-zZ]*.ace', 'sub/**/*.ace', '**/deep/*', '*', 'missing/*',
+])
+def test_find_files_matches_glob(tree, pattern):
+    found = utils.find_files(tree, {'files': pattern})['files']
+    expected = sorted(p for p in tree.glob(pattern) if p.is_file())
+    assert found == expected
+
+
+def test_find_files_several_patterns(tree):
+    found = utils.find_files(tree, {'ace': '**/*.ace', 'n': '**/*-n.ace',
+                                    'top': '*.ace'})
+    assert found['ace'] == sorted(tree.rglob('*.ace'))
+    assert found['n'] == sorted(tree.rglob('*-n.ace'))
+    assert found['top'] == [tree / 'Ab.ace', tree / 'a.ace']
+
+
+# =============================================================================
+# DOWNLOADS
+
+DATA = bytes(range(256)) * 40
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get('Range'))
+        range_header = self.headers.get('Range')
+        honor = server.ranges and range_header is not None and (
+            server.ignore_ranges_after is None or
+            len(server.requests) <= server.ignore_ranges_after)
+        if honor:
+            start, end = map(int, range_header[len('bytes='):].split('-'))
+            body = server.data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             f'bytes {start}-{end}/{len(server.data)}')
+        else:
+            body = server.data
+            self.send_response(200)
+        if server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if server.drop_next:
+            # Send only part of the body to simulate a dropped connection
+            server.drop_next -= 1
+            body = body[:len(body) // 2]
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    httpd.data = DATA
+    httpd.ranges = True
+    httpd.ignore_ranges_after = None
+    httpd.drop_next = 0
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever,
+                              args=(0.05,), daemon=True)
+    thread.start()
+    httpd.url = f'http://127.0.0.1:{httpd.server_address[1]}/file.dat'
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def small_pieces(monkeypatch):
+    monkeypatch.setattr(utils, '_PIECE_SIZE', 1000)
+    monkeypatch.setattr(utils, '_RETRY_DELAY', 0.)
+
+
+def test_download_stream(server, tmp_path):
+    server.ranges = False
+    path = utils.download(server.url, checksum=hashlib.md5(DATA).hexdigest(),
+                          output_path=tmp_path)
+    assert path == tmp_path / 'file.dat'
+    assert path.read_bytes() == DATA
+    assert list(tmp_path.iterdir()) == [path]
+    # The probe response is the file itself, so it is only requested once
+    assert len(server.requests) == 1
+
+
+@pytest.mark.parametrize('connections', [1, 3])
+def test_download_ranges(server, tmp_path, connections):
+    path = utils.download(server.url, checksum=hashlib.md5(DATA).hexdigest(),
+                          output_path=tmp_path, connections=connections)
+    assert path.read_bytes() == DATA
+    assert list(tmp_path.iterdir()) == [path]
+    # One probe plus one request per piece
+    assert len(server.requests) == 1 + -(-len(DATA) // 1000)
+
+
+def test_download_retries_dropped_connection(server, tmp_path):
+    # The probe and the first piece are cut short
+    server.drop_next = 2
+    path = utils.download(server.url, output_path=tmp_path)
+    assert path.read_bytes() == DATA
+    assert len(server.requests) == 2 + -(-len(DATA) // 1000)
+
+
+def test_download_falls_back_without_range_support(server, tmp_path):
+    # Honor the probe, but send the whole file for the pieces
+    server.ignore_ranges_after = 1
+    path = utils.download(server.url, checksum=hashlib.md5(DATA).hexdigest(),
+                          output_path=tmp_path, connections=2)
+    assert path.read_bytes() == DATA
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_download_resumes(server, tmp_path):
+    # Simulate a previous run that finished the first three pieces
+    part_path = tmp_path / 'file.dat.part'
+    part_path.write_bytes(DATA[:3000] + bytes(len(DATA) - 3000))
+    state = {'size': len(DATA), 'validator': '"v1"', 'piece_size': 1000,
+             'done': [0, 1000, 2000]}
+    (tmp_path / 'file.dat.part.json').write_text(json.dumps(state))
+
+    path = utils.download(server.url, output_path=tmp_path)
+    assert path.read_bytes() == DATA
+    requested = set(server.requests[1:])
+    assert 'bytes=0-999' not in requested
+    assert 'bytes=3000-3999' in requested
+
+
+def test_download_restarts_changed_file(server, tmp_path):
+    part_path = tmp_path / 'file.dat.part'
+    part_path.write_bytes(bytes(len(DATA)))
+    state = {'size': len(DATA), 'validator': '"v0"', 'piece_size': 1000,
+             'done': [0, 1000]}
+    (tmp_path / 'file.dat.part.json').write_text(json.dumps(state))
+
+    path = utils.download(server.url, output_path=tmp_path)
+    assert path.read_bytes() == DATA
+
+
+def test_download_skips_existing(server, tmp_path):
+    (tmp_path / 'file.dat').write_bytes(DATA)
+    utils.download(server.url, checksum=hashlib.md5(DATA).hexdigest(),
+                   output_path=tmp_path)
+    assert len(server.requests) == 1
+
+
+def test_download_checksum_mismatch(server, tmp_path):
+    with pytest.raises(OSError, match='checksum'):
+        utils.download(server.url, checksum='0' * 32, output_path=tmp_path)
+    assert not (tmp_path / 'file.dat').exists()
+
+
+def test_download_gives_up_after_retries(server, tmp_path):
+    server.drop_next = 1000
+    with pytest.raises(OSError, match='Unable to download'):
+        utils.download(server.url, output_path=tmp_path)
+    # The partial download is kept for the next run to resume
+    assert (tmp_path / 'file.dat.part').is_file()
+    assert (tmp_path / 'file.dat.part.json').is_file()
+
+
+# =============================================================================
+# CACHING
+
+def test_cache_key(tmp_path, monkeypatch):
+    path = tmp_path / 'n-001_H_001.endf'
+    path.write_bytes(b'abc')
+    key = utils.cache_key([path], 'neutron', 'latest')
+    assert utils.cache_key([path], 'neutron', 'latest') == key
+    assert utils.cache_key([path], 'neutron', 'earliest') != key
+
+    path.write_bytes(b'abd')
+    assert utils.cache_key([path], 'neutron', 'latest') != key
+    path.write_bytes(b'abc')
+
+    # Upgrading the toolchain invalidates everything cached
+    monkeypatch.setattr(utils, '_toolchain_version', lambda: ('0.0.0',))
+    assert utils.cache_key([path], 'neutron', 'latest') != key
+
+
+def test_fetch_store_cached(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    assert utils.fetch_cached(cache_dir, 'key', output_dir) is None
+
+    h5_file = tmp_path / 'H1.h5'
+    h5_file.write_bytes(b'data')
+    utils.store_cached(cache_dir, 'key', h5_file)
+    fetched = utils.fetch_cached(cache_dir, 'key', output_dir)
+    assert fetched == output_dir / 'H1.h5'
+    assert fetched.read_bytes() == b'data'
+
+
+_calls = []
+
+
+def _read_upper(path, suffix):
+    _calls.append(path)
+    return Path(path).read_text().upper() + suffix
+
+
+def test_cached_call(tmp_path):
+    path = tmp_path / 'decay.endf'
+    path.write_text('abc')
+    cache_dir = tmp_path / 'cache'
+    _calls.clear()
+    assert utils.cached_call(cache_dir, _read_upper, path, '!') == 'ABC!'
+    assert utils.cached_call(cache_dir, _read_upper, path, '!') == 'ABC!'
+    assert len(_calls) == 1
+
+    # Other arguments are part of the key
+    assert utils.cached_call(cache_dir, _read_upper, path, '?') == 'ABC?'
+    assert len(_calls) == 2
+
+    # Without a cache directory the function is always called
+    utils.cached_call(None, _read_upper, path, '!')
+    assert len(_calls) == 3
+
+
+# =============================================================================
+# MANIFEST
+
+_conversions = []
+
+
+def _convert(path, destination, libver, scratch_dir=None):
+    _conversions.append(path)
+    h5_file = destination / (path.stem + '.h5')
+    h5_file.write_text(path.read_text() + libver)
+    return h5_file
+
+
+@pytest.fixture
+def source(tmp_path):
+    _conversions.clear()
+    path = tmp_path / 'H1.ace'
+    path.write_text('ace')
+    (tmp_path / 'out').mkdir()
+    return path
+
+
+def _run(path, libver='latest', scratch_dir=None, force=False):
+    destination = path.parent / 'out'
+    with ThreadPool(2) as pool:
+        return utils.convert_all(
+            pool, [(_convert, [path], (path, destination, libver, scratch_dir))],
+            destination, force)
+
+
+def test_convert_all_skips_up_to_date(source):
+    h5_files = _run(source)
+    assert h5_files == [source.parent / 'out' / 'H1.h5']
+    assert _run(source) == h5_files
+    assert len(_conversions) == 1
+
+    # Changing where scratch files go doesn't change the output
+    _run(source, scratch_dir=source.parent / 'scratch')
+    assert len(_conversions) == 1
+
+    # Neither does rewriting a source with the same contents, as happens when
+    # it is extracted and patched again
+    source.write_text('ace')
+    os.utime(source, ns=(0, 0))
+    _run(source)
+    assert len(_conversions) == 1
+
+    _run(source, force=True)
+    assert len(_conversions) == 2
+
+
+def test_convert_all_invalidates(source, monkeypatch):
+    _run(source)
+    _run(source, libver='earliest')
+    assert len(_conversions) == 2
+
+    source.write_text('ace2')
+    _run(source, libver='earliest')
+    assert len(_conversions) == 3
+
+    (source.parent / 'out' / 'H1.h5').unlink()
+    _run(source, libver='earliest')
+    assert len(_conversions) == 4
+
+    monkeypatch.setattr(utils, '_toolchain_version', lambda: ('0.0.0',))
+    _run(source, libver='earliest')
+    assert len(_conversions) == 5
+
+
+# =============================================================================
+# HDF5 EXPORT
+
+class _Data:
+    def export_to_hdf5(self, path, mode, libver):
+        assert mode == 'w'
+        Path(path).write_text(libver)
+
+
+def test_export_to_hdf5_scratch_dir(tmp_path):
+    scratch_dir = tmp_path / 'scratch'
+    scratch_dir.mkdir()
+    h5_file = tmp_path / 'H1.h5'
+    utils.export_to_hdf5(_Data(), h5_file, 'latest', scratch_dir=scratch_dir)
+    assert h5_file.read_text() == 'latest'
+    assert list(scratch_dir.iterdir()) == []
+
+
+def test_export_to_hdf5_keeps_cached_file(tmp_path):
+    # A file hard-linked from the cache must not be overwritten in place
+    cached = tmp_path / 'cached.h5'
+    cached.write_text('old')
+    h5_file = tmp_path / 'H1.h5'
+    os.link(cached, h5_file)
+    utils.export_to_hdf5(_Data(), h5_file, 'earliest')
+    assert h5_file.read_text() == 'earliest'
+    assert cached.read_text() == 'old'
+
+
+def test_export_to_hdf5_round_trip(tmp_path):
+    np = pytest.importorskip('numpy')
+    openmc_data = pytest.importorskip('openmc.data')
+    h1 = openmc_data.IncidentNeutron('H1', 1, 1, 0, 0.999167, [2.53e-2])
+    temperature, = h1.temperatures
+    h1.energy[temperature] = np.logspace(-5, 7, 10)
+    for libver in ('earliest', 'latest'):
+        for compress in (False, True):
+            h5_file = tmp_path / f'H1_{libver}_{compress}.h5'
+            utils.export_to_hdf5(h1, h5_file, libver, compress)
+            data = openmc_data.IncidentNeutron.from_hdf5(h5_file)
+            assert data.name == 'H1'
+            assert data.atomic_weight_ratio == h1.atomic_weight_ratio
+            assert data.temperatures == h1.temperatures
+            assert np.array_equal(data.energy[temperature],
+                                  h1.energy[temperature])
+
+
+# =============================================================================
+# EXTRACTION
+
+def test_extraction_workers(monkeypatch):
+    archives = ['ace_293.tar.gz', 'ace_600.tar.gz', 'ace_900.tar.gz']
+    monkeypatch.setattr(utils.shutil, 'which', lambda name: None)
+    assert utils.extraction_workers(archives) == 2
+    assert utils.extraction_workers(archives[:1]) == 1
+    assert utils.extraction_workers([]) == 1
+
+    monkeypatch.setattr(utils.shutil, 'which', lambda name: f'/usr/bin/{name}')
+    assert utils.extraction_workers(archives) == 1
+    assert utils.extraction_workers(['JEFF32-ACE-293K.zip', 'a.zip']) == 2
+
+
+# =============================================================================
+# PATCHING
+
+def test_patch_file(tmp_path):
+    path = tmp_path / 'bebeo.acer'
+    path.write_text('4009.10t\n   4009   8016\n 1.8016E+00\n')
+    assert utils.patch_file(path, '8016', '   0', lines=2)
+    assert path.read_text() == '4009.10t\n   4009      0\n 1.8016E+00\n'
+
+    # Running again leaves the rest of the file alone
+    assert not utils.patch_file(path, '8016', '   0', lines=2)
+    assert path.read_text() == '4009.10t\n   4009      0\n 1.8016E+00\n'
+
+    # Without a limit, the first occurrence anywhere is replaced
+    assert utils.patch_file(path, '8016', '8017')
+    assert path.read_text() == '4009.10t\n   4009      0\n 1.8017E+00\n'
+
+
+def test_patch_file_edge_cases(tmp_path):
+    path = tmp_path / 'empty.acer'
+    path.write_bytes(b'')
+    assert not utils.patch_file(path, '8016', '   0')
+
+    path.write_text('8016')
+    assert utils.patch_file(path, '8016', '   0', lines=10)
+    with pytest.raises(ValueError):
+        utils.patch_file(path, '8016', '0')
+
+
+@pytest.fixture
+def archive_tree(tmp_path):
+    src = tmp_path / 'src'
+    for name, size in [('lib/endf/a.ace', 3000), ('lib/b.ace', 10), ('c.ace', 0)]:
+        path = src / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(os.urandom(size))
+    return src
+
+
+def _files(directory):
+    return {p.relative_to(directory).as_posix(): p.read_bytes()
+            for p in sorted(Path(directory).rglob('*')) if p.is_file()}
+
+
+def _make_zip(src, path):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for p in sorted(src.rglob('*')):
+            zipf.write(p, p.relative_to(src.parent))
+    return path
+
+
+def _make_tar(src, path, mode):
+    with tarfile.open(path, mode) as tar:
+        tar.add(src, arcname=src.name)
+    return path
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_extract_zip(archive_tree, tmp_path, workers):
+    archive = _make_zip(archive_tree, tmp_path / 'a.zip')
+    utils.extract_zip(archive, tmp_path / 'out', workers=workers)
+    assert _files(tmp_path / 'out' / 'src') == _files(archive_tree)
+
+    utils.extract_zip(archive, tmp_path / 'flat', workers=workers, flatten=True)
+    assert _files(tmp_path / 'flat') == {
+        Path(name).name: data for name, data in _files(archive_tree).items()}
+
+
+@pytest.mark.parametrize('flatten', [False, True])
+def test_extract_zip_stays_inside(tmp_path, flatten):
+    archive = tmp_path / 'a.zip'
+    with zipfile.ZipFile(archive, 'w') as zipf:
+        for name in ['../escaped_dir/f', '/abs/g', 'ok/h']:
+            zipf.writestr(name, name)
+    out = tmp_path / 'sub' / 'out'
+    utils.extract_zip(archive, out, workers=2, flatten=flatten)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.zip', 'sub']
+    assert sorted(p.name for p in out.parent.iterdir()) == ['out']
+    if flatten:
+        assert set(_files(out)) == {'f', 'g', 'h'}
+    else:
+        assert set(_files(out)) == {'escaped_dir/f', 'abs/g', 'ok/h'}
+    utils.extract_zip(archive, out, flatten=flatten, skip_existing=True)
+
+
+@pytest.mark.parametrize('name, mode', [('a.tar', 'w'), ('a.tar.gz', 'w:gz'),
+                                        ('a.tar.bz2', 'w:bz2')])
+@pytest.mark.parametrize('parallel', [False, True])
+def test_extract_tar(archive_tree, tmp_path, monkeypatch, name, mode, parallel):
+    if not parallel:
+        monkeypatch.setattr(utils, '_parallel_decompressor', lambda path: None)
+    elif name != 'a.tar' and utils._parallel_decompressor(Path(name)) is None:
+        pytest.skip('no parallel decompressor available')
+    archive = _make_tar(archive_tree, tmp_path / name, mode)
+    utils.extract_tar(archive, tmp_path / 'out')
+    assert _files(tmp_path / 'out' / 'src') == _files(archive_tree)
+
+    utils.extract_tar(archive, tmp_path / 'flat', flatten=True)
+    assert _files(tmp_path / 'flat') == {
+        Path(name).name: data for name, data in _files(archive_tree).items()}
+
+
+@pytest.mark.parametrize('flatten', [False, True])
+@pytest.mark.parametrize('kind', ['zip', 'tar'])
+def test_extract_skip_existing(archive_tree, tmp_path, flatten, kind):
+    if kind == 'zip':
+        archive = _make_zip(archive_tree, tmp_path / 'a.zip')
+        extract = utils.extract_zip
+    else:
+        archive = _make_tar(archive_tree, tmp_path / 'a.tar.gz', 'w:gz')
+        extract = utils.extract_tar
+    out = tmp_path / 'out'
+    extract(archive, out, flatten=flatten)
+    root = out if flatten else out / 'src'
+    a = root / ('a.ace' if flatten else 'lib/endf/a.ace')
+    b = root / ('b.ace' if flatten else 'lib/b.ace')
+
+    # A file of the right size is kept, one of the wrong size is replaced
+    a.write_bytes(bytes(3000))
+    b.write_bytes(b'x')
+    extract(archive, out, flatten=flatten, skip_existing=True)
+    assert a.read_bytes() == bytes(3000)
+    assert b.read_bytes() == (archive_tree / 'lib' / 'b.ace').read_bytes()
+
+    extract(archive, out, flatten=flatten)
+    assert a.read_bytes() == (archive_tree / 'lib' / 'endf' / 'a.ace').read_bytes()
+
+
+# =============================================================================
+# MISCELLANEOUS
+
+def test_pipeline():
+    assert list(utils.pipeline(lambda x: 2*x, range(5))) == [0, 2, 4, 6, 8]
+    assert list(utils.pipeline(lambda x: x, [])) == []
+
+
+def test_pipeline_stops_early():
+    calls = []
+
+    def func(x):
+        calls.append(x)
+        time.sleep(0.01)
+        return x
+
+    for x in utils.pipeline(func, range(100)):
+        if x == 1:
+            break
+    # At most the item being worked on when the loop ended is still processed
+    assert len(calls) <= 3
+
+
+def test_pipeline_propagates_errors():
+    def func(x):
+        if x == 2:
+            raise ValueError(x)
+        return x
+
+    results = utils.pipeline(func, range(5))
+    assert next(results) == 0
+    assert next(results) == 1
+    with pytest.raises(ValueError):
+        next(results)
+
+
+def test_endf_awr(tmp_path):
+    pytest.importorskip('openmc.data')
+    path = tmp_path / 'n-092_U_238.endf'
+    path.write_text(
+        ' $Rev:: 532      $  $Date:: 2011-12-05#$                             1 0  0    0\n'
+        ' 9.223800+4 2.360058+2          1          1          0          59237 1451    1\n')
+    assert utils.endf_awr(path) == pytest.approx(236.0058)
+
+    path.write_text('not an ENDF file\n')
+    assert utils.endf_awr(path) == 0.0
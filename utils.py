@@ -1,16 +1,100 @@
+import fnmatch
 import hashlib
+import json
+import mmap
+import os
+import pickle
+import shutil
+import subprocess
+import tarfile
+import threading
+import time
 import warnings
-import openmc.data
-from pathlib import Path
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from http.client import HTTPException
+from pathlib import Path, PurePath
 from urllib.parse import urlparse
 from urllib.request import urlopen, Request
 
-_BLOCK_SIZE = 16384
+# openmc.data and h5py are imported in the functions that convert data rather
+# than here, so that the download, extraction and bookkeeping helpers can be
+# used and tested without them. Scripts import openmc at module level.
 
+_BLOCK_SIZE = 1024*1024
+_TAR_BUFSIZE = 1024*1024
+_COMPRESS_THRESHOLD = 32768
+_CACHE_KEY_BYTES = 1024*1024
+_RETRIES = 5
+_RETRY_DELAY = 1.
+_PIECE_SIZE = 64*1024*1024
+_MANIFEST_NAME = '.manifest.json'
+_PROGRESS_INTERVAL = 0.2
+_EXTRACT_WORKERS = 2
 
-def process_neutron(path, output_dir, libver, temperatures=None):
+
+def _fadvise(paths, advice):
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, getattr(os, advice))
+        finally:
+            os.close(fd)
+
+
+def drop_cache(paths):
+    """Advise the kernel that files which have been read for the last time
+    won't be needed again
+
+    Each evaluation is read once during conversion, so keeping it in the page
+    cache only evicts pages that are still useful, e.g. to concurrent workers.
+    This does nothing on platforms without :func:`os.posix_fadvise`.
+
+    Parameters
+    ----------
+    paths : iterable of str or Path
+        Files to drop from the page cache
+
+    """
+    _fadvise(paths, 'POSIX_FADV_DONTNEED')
+
+
+def prefetch(paths):
+    """Advise the kernel that files are about to be read
+
+    The kernel starts reading the files into the page cache in the background
+    and returns immediately, so many files can be fetched from storage at
+    once before a serial consumer gets to them. This does nothing on
+    platforms without :func:`os.posix_fadvise`.
+
+    Parameters
+    ----------
+    paths : iterable of str or Path
+        Files to read ahead
+
+    """
+    _fadvise(paths, 'POSIX_FADV_WILLNEED')
+
+
+def process_neutron(path, output_dir, libver, temperatures=None, compress=False,
+                    cache_dir=None, scratch_dir=None):
     """Process ENDF neutron sublibrary file into HDF5 and write into a
     specified output directory."""
+    import openmc.data
+
+    if cache_dir is not None:
+        key = cache_key([path], temperatures, libver, compress)
+        h5_file = fetch_cached(cache_dir, key, output_dir)
+        if h5_file is not None:
+            print(f'Using cached {h5_file} for {path}')
+            return h5_file
+
     print(f'Converting: {path}')
     try:
         with warnings.catch_warnings():
@@ -23,12 +107,27 @@ def process_neutron(path, output_dir, libver, temperatures=None):
         raise
     h5_file = output_dir / f'{data.name}.h5'
     print(f'Writing {h5_file} ...')
-    data.export_to_hdf5(h5_file, 'w', libver=libver)
+    export_to_hdf5(data, h5_file, libver, compress, scratch_dir)
+    drop_cache([path])
+
+    if cache_dir is not None:
+        store_cached(cache_dir, key, h5_file)
+    return h5_file
 
 
-def process_thermal(path_neutron, path_thermal, output_dir, libver):
+def process_thermal(path_neutron, path_thermal, output_dir, libver,
+                    compress=False, cache_dir=None, scratch_dir=None):
     """Process ENDF thermal scattering sublibrary file into HDF5 and write into a
     specified output directory."""
+    import openmc.data
+
+    if cache_dir is not None:
+        key = cache_key([path_neutron, path_thermal], libver, compress)
+        h5_file = fetch_cached(cache_dir, key, output_dir)
+        if h5_file is not None:
+            print(f'Using cached {h5_file} for {path_thermal}')
+            return h5_file
+
     print(f'Converting: {path_thermal}')
     try:
         with warnings.catch_warnings():
@@ -41,12 +140,892 @@ def process_thermal(path_neutron, path_thermal, output_dir, libver):
         raise
     h5_file = output_dir / f'{data.name}.h5'
     print(f'Writing {h5_file} ...')
-    data.export_to_hdf5(h5_file, 'w', libver=libver)
+    export_to_hdf5(data, h5_file, libver, compress, scratch_dir)
+    drop_cache([path_thermal])
+
+    if cache_dir is not None:
+        store_cached(cache_dir, key, h5_file)
+    return h5_file
+
+
+def process_photon(photo_path, atom_path, output_dir, libver, compress=False):
+    """Process ENDF photoatomic and atomic relaxation sublibrary files into
+    HDF5 and write into a specified output directory."""
+    import openmc.data
+
+    print('Converting:', photo_path.name, atom_path.name)
+    data = openmc.data.IncidentPhoton.from_endf(photo_path, atom_path)
+    h5_file = output_dir / f'{data.name}.h5'
+    export_to_hdf5(data, h5_file, libver, compress)
+    drop_cache([photo_path, atom_path])
+    return h5_file
+
+
+@lru_cache(maxsize=None)
+def _toolchain_version():
+    """Return the versions of the software that converts nuclear data
+
+    This covers openmc, h5py and the HDF5 library it is built against, and
+    the NJOY executable on the PATH. NJOY doesn't report its version without
+    running a job, so its resolved path, size and modification time stand in
+    for it.
+
+    Returns
+    -------
+    tuple
+        Version information that changes whenever any of the tools is
+        upgraded
+
+    """
+    versions = []
+    try:
+        import openmc
+        versions.append(openmc.__version__)
+    except ImportError:
+        versions.append(None)
+    try:
+        import h5py
+        versions.append((h5py.version.version, h5py.version.hdf5_version))
+    except ImportError:
+        versions.append(None)
+    njoy = shutil.which('njoy')
+    if njoy is not None:
+        stat = os.stat(njoy)
+        njoy = (os.path.realpath(njoy), stat.st_size, stat.st_mtime_ns)
+    versions.append(njoy)
+    return tuple(versions)
+
+
+def cache_key(paths, *options):
+    """Return a key identifying a set of input files and processing options
+
+    Only the size and first megabyte of each file are hashed, which is enough
+    to tell evaluations apart without reading every file in full. The versions
+    returned by :func:`_toolchain_version` are part of the key, so results
+    produced by an older openmc, h5py or NJOY are not reused after an upgrade.
+
+    Parameters
+    ----------
+    paths : iterable of str or Path
+        Input files
+    *options
+        Any other values that affect the output
+
+    Returns
+    -------
+    str
+        Hexadecimal digest
+
+    """
+    h = hashlib.blake2b()
+    for path in paths:
+        with open(path, 'rb') as fh:
+            h.update(fh.read(_CACHE_KEY_BYTES))
+        h.update(str(os.path.getsize(path)).encode())
+    h.update(repr(_toolchain_version()).encode())
+    h.update(repr(options).encode())
+    return h.hexdigest()
+
+
+def _manifest_key(sources):
+    return '|'.join(str(Path(p).resolve()) for p in sources)
+
+
+def _is_path(arg):
+    if isinstance(arg, (list, tuple)):
+        return len(arg) > 0 and all(isinstance(a, PurePath) for a in arg)
+    return isinstance(arg, PurePath)
+
+
+def _output_options(args):
+    """Return a string identifying the arguments of a conversion job that
+    affect what it writes, along with the versions of the tools used
+
+    Paths are left out since the sources are identified by their contents, and
+    the directories the output, cache and scratch files go to don't change what
+    is written. None is left out so that leaving an optional directory unset
+    is the same as setting it.
+
+    """
+    options = tuple(a for a in args if a is not None and not _is_path(a))
+    return repr((_toolchain_version(),) + options)
+
+
+def _source_stats(sources):
+    return [[s.st_size, s.st_mtime_ns] for s in map(os.stat, sources)]
+
+
+def _up_to_date(entry, sources, options, output_dir):
+    """Return the HDF5 file(s) recorded in a manifest entry if they were written
+    with the same options from the same source files
 
+    Sources whose size and modification time are unchanged are assumed to be
+    the same. Otherwise their contents are compared through
+    :func:`cache_key`, so that a file that was re-extracted or patched in place
+    to the same contents doesn't count as a change.
 
-def download(url, checksum=None, as_browser=False, output_path=None, **kwargs):
+    """
+    if entry is None or entry.get('options') != options:
+        return None
+    recorded = entry['h5_file']
+    h5_files = [Path(output_dir, f) for f in recorded] \
+        if isinstance(recorded, list) else [Path(output_dir, recorded)]
+    if not h5_files or not all(f.is_file() for f in h5_files):
+        return None
+    try:
+        stats = _source_stats(sources)
+        if stats != entry['stats'] and cache_key(sources) != entry['digest']:
+            return None
+    except OSError:
+        return None
+    entry['stats'] = stats
+    return h5_files if isinstance(recorded, list) else h5_files[0]
+
+
+def _manifest_entry(h5_file, sources, options, output_dir):
+    if isinstance(h5_file, list):
+        recorded = [os.path.relpath(f, output_dir) for f in h5_file]
+    else:
+        recorded = os.path.relpath(h5_file, output_dir)
+    return {'h5_file': recorded, 'options': options,
+            'stats': _source_stats(sources), 'digest': cache_key(sources)}
+
+
+def convert_all(pool, jobs, output_dir, force=False):
+    """Run conversion jobs in a process pool, skipping up-to-date outputs
+
+    A manifest in the output directory records which source files and options
+    each HDF5 file was produced from. A job is skipped if its HDF5 file was
+    produced from the same sources with the same options and versions of
+    openmc, h5py and NJOY, so that re-running a script only converts what
+    changed. Arguments that are paths, e.g. the destination, cache or scratch
+    directories, are not considered options.
+
+    Parameters
+    ----------
+    pool : multiprocessing.Pool
+        Pool in which to run the conversions
+    jobs : iterable of tuple
+        Each job is a tuple of (func, sources, args) where ``func(*args)``
+        converts the list of `sources` files and returns the path of the HDF5
+        file it wrote, or a list of paths if it wrote several
+    output_dir : Path
+        Directory in which the manifest is kept
+    force : bool
+        Whether to convert every job regardless of the manifest
+
+    Returns
+    -------
+    list
+        HDF5 file (or list of files) for each job in the same order as `jobs`
+
+    """
+    manifest_path = Path(output_dir) / _MANIFEST_NAME
+    manifest = {}
+    if manifest_path.is_file():
+        try:
+            manifest = json.loads(manifest_path.read_text())
+        except ValueError:
+            pass
+
+    results = []
+    for func, sources, args in jobs:
+        key = _manifest_key(sources)
+        options = _output_options(args)
+        h5_file = None if force else _up_to_date(
+            manifest.get(key), sources, options, output_dir)
+        if h5_file is not None:
+            print(f'Skipping {sources[0]}, output is up to date')
+            results.append((key, sources, options, h5_file))
+        else:
+            results.append((key, sources, options, pool.apply_async(func, args)))
+
+    h5_files = []
+    try:
+        for key, sources, options, result in results:
+            if isinstance(result, (Path, list)):
+                h5_file = result
+            else:
+                h5_file = result.get()
+                if isinstance(h5_file, list):
+                    h5_file = [Path(f) for f in h5_file]
+                else:
+                    h5_file = Path(h5_file)
+                manifest[key] = _manifest_entry(h5_file, sources, options,
+                                                output_dir)
+                drop_cache(sources)
+            h5_files.append(h5_file)
+    finally:
+        # Record whatever finished, even if a conversion failed
+        manifest_path.write_text(json.dumps(manifest, indent=2))
+    return h5_files
+
+
+def _link_or_copy(source, target):
+    if target.exists():
+        target.unlink()
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def fetch_cached(cache_dir, key, output_dir):
+    """Place a cached HDF5 file in an output directory
+
+    Parameters
+    ----------
+    cache_dir : str or Path
+        Cache directory
+    key : str
+        Key returned by :func:`cache_key`
+    output_dir : str or Path
+        Directory to place the file in
+
+    Returns
+    -------
+    pathlib.Path or None
+        Path of the file in the output directory, or None if nothing is
+        cached for the key
+
+    """
+    for cached_file in (Path(cache_dir) / key).glob('*.h5'):
+        h5_file = Path(output_dir) / cached_file.name
+        _link_or_copy(cached_file, h5_file)
+        return h5_file
+
+
+def store_cached(cache_dir, key, h5_file):
+    """Store an HDF5 file in the cache
+
+    Files are hard-linked into the cache when possible so that caching doesn't
+    take up additional disk space.
+
+    Parameters
+    ----------
+    cache_dir : str or Path
+        Cache directory
+    key : str
+        Key returned by :func:`cache_key`
+    h5_file : str or Path
+        HDF5 file to store
+
+    """
+    h5_file = Path(h5_file)
+    entry = Path(cache_dir) / key
+    entry.mkdir(parents=True, exist_ok=True)
+    _link_or_copy(h5_file, entry / h5_file.name)
+
+
+def cached_call(cache_dir, func, path, *args):
+    """Call a function on a file, reusing the result from a previous run
+
+    The result is pickled in the cache directory under a key computed by
+    :func:`cache_key` from the file, the function name and any other
+    arguments. Loading the pickle is much faster than parsing an ENDF file
+    again.
+
+    Parameters
+    ----------
+    cache_dir : str or Path or None
+        Cache directory. If None, the function is always called.
+    func : callable
+        Function to call as ``func(path, *args)``. Its return value must be
+        picklable.
+    path : str or Path
+        Input file
+    *args
+        Any other arguments to pass to the function
+
+    Returns
+    -------
+    object
+        Return value of the function
+
+    """
+    if cache_dir is None:
+        return func(path, *args)
+
+    key = cache_key([path], func.__qualname__, *args)
+    cache_file = Path(cache_dir) / f'{key}.pickle'
+    try:
+        with open(cache_file, 'rb') as fh:
+            return pickle.load(fh)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    result = func(path, *args)
+
+    # Write to a temporary file first so that concurrent workers never see a
+    # partially written pickle
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_name(f'{cache_file.name}.{os.getpid()}')
+    with open(tmp_file, 'wb') as fh:
+        pickle.dump(result, fh, pickle.HIGHEST_PROTOCOL)
+    tmp_file.replace(cache_file)
+    return result
+
+
+def _copy_compressed(source, target):
+    """Recursively copy an HDF5 group, compressing large datasets"""
+    import h5py
+
+    for key in source.attrs:
+        target.attrs.create(key, source.attrs[key],
+                            dtype=source.attrs.get_id(key).dtype)
+    for name, obj in source.items():
+        if isinstance(obj, h5py.Group):
+            _copy_compressed(obj, target.create_group(name))
+        elif obj.nbytes > _COMPRESS_THRESHOLD:
+            dset = target.create_dataset(
+                name, data=obj[()], chunks=True, compression='gzip',
+                compression_opts=4, shuffle=True)
+            for key in obj.attrs:
+                dset.attrs.create(key, obj.attrs[key],
+                                  dtype=obj.attrs.get_id(key).dtype)
+        else:
+            source.copy(obj, target, name=name)
+
+
+def export_to_hdf5(data, path, libver, compress=False, scratch_dir=None):
+    """Export nuclear data to an HDF5 file
+
+    Parameters
+    ----------
+    data : openmc.data.IncidentNeutron or openmc.data.ThermalScattering or openmc.data.IncidentPhoton
+        Data to export
+    path : str or Path
+        Path of the HDF5 file to write
+    libver : {'earliest', 'latest'}
+        Compatibility mode for the HDF5 file
+    compress : bool
+        Whether to store large datasets chunked and compressed with gzip
+    scratch_dir : str or Path, optional
+        Directory on a fast local filesystem in which to write the file before
+        moving it to `path`. This avoids many small writes going to a slow
+        (e.g., networked) destination.
+
+    """
+    path = Path(path)
+
+    # Remove any existing file rather than truncating it, since it may be
+    # hard-linked from the output cache
+    if path.exists():
+        path.unlink()
+
+    if scratch_dir is not None:
+        write_path = Path(scratch_dir) / path.name
+    else:
+        write_path = path
+
+    if compress:
+        import h5py
+
+        # Write uncompressed data to a temporary file and then copy it to the
+        # final file with compression enabled on large datasets
+        tmp_path = write_path.with_name(write_path.name + '.tmp')
+        data.export_to_hdf5(tmp_path, 'w', libver=libver)
+        try:
+            with h5py.File(tmp_path, 'r') as source, \
+                 h5py.File(write_path, 'w', libver=libver) as target:
+                _copy_compressed(source, target)
+        finally:
+            tmp_path.unlink()
+    else:
+        data.export_to_hdf5(write_path, 'w', libver=libver)
+
+    # Renames when the scratch directory is on the same filesystem, otherwise
+    # copies the finished file in one pass
+    if write_path != path:
+        shutil.move(write_path, path)
+
+
+def _match_glob(parts, pattern_parts):
+    """Return whether the components of a relative path match those of a glob
+    pattern with the semantics of :meth:`pathlib.Path.glob`"""
+    if not pattern_parts:
+        return not parts
+    if pattern_parts[0] == '**':
+        # '**' matches any number of directories, including none, but never
+        # the file name itself
+        return any(_match_glob(parts[i:], pattern_parts[1:])
+                   for i in range(len(parts)))
+    return (bool(parts) and fnmatch.fnmatchcase(parts[0], pattern_parts[0])
+            and _match_glob(parts[1:], pattern_parts[1:]))
+
+
+def find_files(directory, patterns):
+    """Find files matching several glob patterns with a single directory walk
+
+    Calling :meth:`pathlib.Path.glob` once per pattern walks the tree each
+    time. Here, every file is visited once and its path relative to
+    `directory` is checked against each pattern. Patterns have the same
+    meaning as for :meth:`pathlib.Path.glob`: ``*`` does not cross directory
+    boundaries and ``**`` matches any number of directories, so ``'*.ace'``
+    only finds files directly in `directory` while ``'**/*.ace'`` finds them
+    at any depth like :meth:`pathlib.Path.rglob`. If no pattern contains
+    ``**``, directories deeper than the longest pattern aren't visited.
+
+    Parameters
+    ----------
+    directory : str or Path
+        Directory to search
+    patterns : dict
+        Mapping of category names to glob-style patterns relative to
+        `directory`, matched case-sensitively
+
+    Returns
+    -------
+    dict
+        Mapping of category names to sorted lists of matching files. A file
+        matching several patterns appears in each of the categories.
+
+    """
+    split_patterns = {category: tuple(pattern.split('/'))
+                      for category, pattern in patterns.items()}
+    if any('**' in parts for parts in split_patterns.values()):
+        max_depth = None
+    else:
+        max_depth = max((len(parts) for parts in split_patterns.values()),
+                        default=0)
+
+    found = {category: [] for category in patterns}
+    for dirpath, dirnames, filenames in os.walk(directory):
+        relative = os.path.relpath(dirpath, directory)
+        dir_parts = () if relative == os.curdir else tuple(relative.split(os.sep))
+        if max_depth is not None and len(dir_parts) + 1 >= max_depth:
+            # Files in subdirectories would be too deep to match
+            dirnames.clear()
+        for filename in filenames:
+            parts = dir_parts + (filename,)
+            for category, pattern_parts in split_patterns.items():
+                if _match_glob(parts, pattern_parts):
+                    found[category].append(Path(dirpath, filename))
+    for paths in found.values():
+        paths.sort()
+    return found
+
+
+def patch_file(path, old, new, lines=None):
+    """Replace the first occurrence of a string in a file in place
+
+    Only the pages containing the match are rewritten, so `new` must have the
+    same length as `old`. Only the first occurrence is replaced. To make
+    running a script again harmless, limit the search with `lines` to a part
+    of the file where `old` occurs once; after patching it is no longer
+    found there and the file is left alone.
+
+    Parameters
+    ----------
+    path : str or Path
+        File to modify
+    old : str
+        String to look for
+    new : str
+        String of the same length to replace it with
+    lines : int, optional
+        Only search the first `lines` lines of the file
+
+    Returns
+    -------
+    bool
+        Whether the file was modified
+
+    """
+    old, new = old.encode(), new.encode()
+    if len(old) != len(new):
+        raise ValueError('Replacement must have the same length as the original')
+    if os.path.getsize(path) == 0:
+        return False
+    with open(path, 'r+b') as fh, mmap.mmap(fh.fileno(), 0) as mm:
+        end = len(mm)
+        if lines is not None:
+            end = 0
+            for _ in range(lines):
+                end = mm.find(b'\n', end) + 1
+                if end == 0:
+                    end = len(mm)
+                    break
+        offset = mm.find(old, 0, end)
+        if offset < 0:
+            return False
+        mm[offset:offset + len(new)] = new
+    return True
+
+
+def endf_awr(path):
+    """Return the atomic weight ratio of the target in an ENDF file.
+
+    Only the head record of MF=1, MT=451 is read, which makes this cheap enough
+    to use as a sort key for dispatching heavy nuclides (which take longest to
+    process with NJOY) first."""
+    import openmc.data
+
+    with open(path, 'r') as fh:
+        for _, line in zip(range(5), fh):
+            if line[70:75] == ' 1451':
+                return openmc.data.endf.float_endf(line[11:22])
+    return 0.0
+
+
+def pipeline(func, iterable):
+    """Apply a function to each item of an iterable in a background thread
+
+    Items are processed one at a time and in order, so the caller can work on
+    one result (e.g., extracting an archive) while the next one is being
+    produced (e.g., downloaded).
+
+    Parameters
+    ----------
+    func : callable
+        Function to apply to each item
+    iterable : iterable
+        Items to pass to the function
+
+    Yields
+    ------
+    object
+        Return value of the function for each item
+
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        futures = [executor.submit(func, item) for item in iterable]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            # Don't start any remaining work if the caller bails out early
+            for future in futures:
+                future.cancel()
+
+
+def _is_extracted(target_path, size):
+    """Return whether an archive member of a given size already exists on disk"""
+    try:
+        return os.stat(target_path).st_size == size
+    except OSError:
+        return False
+
+
+def _extract_members(tar, extraction_dir, flatten, skip_existing):
+    if flatten:
+        for member in tar:
+            if member.isreg():
+                member.name = Path(member.name).name
+                if skip_existing and _is_extracted(
+                        Path(extraction_dir) / member.name, member.size):
+                    continue
+                tar.extract(member, path=extraction_dir)
+    elif skip_existing:
+        tar.extractall(extraction_dir, members=(
+            member for member in tar
+            if not (member.isreg() and _is_extracted(
+                Path(extraction_dir) / member.name, member.size))
+        ))
+    else:
+        tar.extractall(extraction_dir)
+
+
+def _parallel_decompressor(path):
+    """Return the command line of a multithreaded decompressor for an archive,
+    or None if none is available"""
+    if path.name.endswith(('.gz', '.tgz')):
+        candidates = ['pigz']
+    elif path.name.endswith(('.bz2', '.tbz2')):
+        candidates = ['lbzip2', 'pbzip2']
+    else:
+        return None
+    for name in candidates:
+        executable = shutil.which(name)
+        if executable is not None:
+            return [executable, '-dc', str(path)]
+    return None
+
+
+def extraction_workers(archives):
+    """Return how many archives to extract at once
+
+    Archives that pigz or lbzip2/pbzip2 can decompress already use every core
+    and saturate the disk, so they are extracted one at a time. Otherwise,
+    each archive is decompressed on a single core and two are extracted at
+    once.
+
+    Parameters
+    ----------
+    archives : iterable of str or Path
+        Names of the archives that will be extracted
+
+    Returns
+    -------
+    int
+        Number of archives to extract concurrently
+
+    """
+    archives = [Path(a) for a in archives]
+    if any(_parallel_decompressor(a) is not None for a in archives):
+        return 1
+    return max(1, min(_EXTRACT_WORKERS, len(archives)))
+
+
+def extract_tar(path, extraction_dir, flatten=False, skip_existing=False):
+    """Extract a tar archive
+
+    Gzip- and bzip2-compressed archives are decompressed by pigz and
+    lbzip2/pbzip2, respectively, in a separate process when available and
+    streamed into :mod:`tarfile`. These use all cores and are considerably
+    faster than decompressing with the zlib or bz2 modules in-process.
+    Members are copied out in 1 MiB blocks rather than tarfile's default of
+    16 KiB to cut down on system calls for large ACE files.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path to the tar archive
+    extraction_dir : str or Path
+        Directory to extract files into
+    flatten : bool
+        Whether to ignore the folder structure within the archive
+    skip_existing : bool
+        Whether to skip members for which a file of the same size already
+        exists, e.g., when re-running a script on an extracted library
+
+    """
+    path = Path(path)
+    command = _parallel_decompressor(path)
+    if command is None:
+        with tarfile.open(path, 'r', copybufsize=_TAR_BUFSIZE) as tar:
+            _extract_members(tar, extraction_dir, flatten, skip_existing)
+        return
+
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE)
+    with proc:
+        with tarfile.open(fileobj=proc.stdout, mode='r|', bufsize=_TAR_BUFSIZE,
+                          copybufsize=_TAR_BUFSIZE) as tar:
+            _extract_members(tar, extraction_dir, flatten, skip_existing)
+
+        # Consume any padding after the end-of-archive marker so that the
+        # decompressor doesn't fail writing to a closed pipe
+        while proc.stdout.read(_BLOCK_SIZE):
+            pass
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args)
+
+
+def _zip_member_path(name, flatten=False):
+    # Same cleaning as ZipFile.extract, which drops drive letters and empty,
+    # '.' and '..' components so that nothing is written outside the
+    # extraction directory
+    name = name.replace('/', os.path.sep)
+    if os.path.altsep:
+        name = name.replace(os.path.altsep, os.path.sep)
+    name = os.path.splitdrive(name)[1]
+    member_path = os.path.sep.join(
+        part for part in name.split(os.path.sep)
+        if part not in ('', os.path.curdir, os.path.pardir))
+    return os.path.basename(member_path) if flatten else member_path
+
+
+def _extract_zip_members(path, names, extraction_dir, flatten):
+    # Each worker opens its own handle since a ZipFile can't be read from
+    # several threads at once
+    with zipfile.ZipFile(path) as zipf:
+        for name in names:
+            if not flatten:
+                zipf.extract(name, extraction_dir)
+            elif not name.endswith('/'):
+                filename = _zip_member_path(name, flatten=True)
+                if not filename:
+                    continue
+                target_path = Path(extraction_dir) / filename
+                with zipf.open(name) as source, open(target_path, 'wb') as target:
+                    shutil.copyfileobj(source, target, _TAR_BUFSIZE)
+
+
+def extract_zip(path, extraction_dir='.', workers=None, flatten=False,
+                skip_existing=False):
+    """Extract a ZIP archive using several threads
+
+    Members of a ZIP archive are compressed independently and zlib releases
+    the GIL while inflating, so the members are split among a pool of threads
+    that each extract their share through a separate file handle.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path to the ZIP archive
+    extraction_dir : str or Path
+        Directory to extract files into
+    workers : int or None
+        Number of threads to use. Defaults to the number of CPUs.
+    flatten : bool
+        Whether to ignore the folder structure within the archive
+    skip_existing : bool
+        Whether to skip members for which a file of the same size already
+        exists, e.g., when re-running a script on an extracted library
+
+    """
+    with zipfile.ZipFile(path) as zipf:
+        if skip_existing:
+            names = [
+                info.filename for info in zipf.infolist()
+                if info.is_dir() or not _is_extracted(
+                    Path(extraction_dir) / _zip_member_path(info.filename, flatten),
+                    info.file_size)
+            ]
+        else:
+            names = zipf.namelist()
+    workers = min(workers or os.cpu_count() or 1, len(names)) or 1
+
+    # Create directories up front so that workers don't race to create them
+    directories = {''}
+    if not flatten:
+        for name in names:
+            member_path = _zip_member_path(name)
+            directories.add(member_path if name.endswith('/')
+                            else os.path.dirname(member_path))
+    for directory in directories:
+        (Path(extraction_dir) / directory).mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(_extract_zip_members, path, names[i::workers],
+                            extraction_dir, flatten)
+            for i in range(workers)
+        ]
+        for future in futures:
+            future.result()
+
+
+def _md5sum(path):
+    """Compute the MD5 checksum of a file without reading it all into memory"""
+    with open(path, 'rb') as fh:
+        # Python 3.11+ reads into a reusable buffer and hashes it with the GIL
+        # released
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(fh, 'md5').hexdigest()
+        md5 = hashlib.md5()
+        for chunk in iter(lambda: fh.read(_BLOCK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class _RangeNotSupported(Exception):
+    """Raised when a server answers a range request with the whole file"""
+
+
+def _download_range(url, headers, path, start, end, progress, **kwargs):
+    """Download bytes [start, end) of a URL into the same position of a file,
+    picking up from where it left off if the connection drops. Attempts are
+    spaced out with exponential backoff."""
+    error = None
+    for attempt in range(_RETRIES):
+        if attempt > 0:
+            time.sleep(_RETRY_DELAY * 2**(attempt - 1))
+        request = Request(url, headers=dict(headers, Range=f'bytes={start}-{end - 1}'))
+        try:
+            with urlopen(request, **kwargs) as response:
+                if response.status != 206:
+                    raise _RangeNotSupported(url)
+                with open(path, 'r+b') as fh:
+                    fh.seek(start)
+                    while start < end:
+                        chunk = response.read(min(_BLOCK_SIZE, end - start))
+                        if not chunk:
+                            break
+                        fh.write(chunk)
+                        start += len(chunk)
+                        progress(len(chunk))
+        except (OSError, HTTPException) as e:
+            error = e
+        if start >= end:
+            return
+    raise OSError(f'Unable to download {url}') from error
+
+
+def _download_pieces(url, headers, part_path, file_size, validator,
+                     connections, progress, **kwargs):
+    """Download a file in pieces with range requests, skipping the pieces that
+    a previous, interrupted run already completed
+
+    The pieces that have been written to the partial file are recorded in a
+    JSON file next to it, along with the piece size and the size and
+    ETag/Last-Modified header of the file so that a partial download of a file that has since changed on
+    the server is started over.
+
+    """
+    state_path = part_path.with_name(part_path.name + '.json')
+    state = {'size': file_size, 'validator': validator,
+             'piece_size': _PIECE_SIZE, 'done': []}
+    if part_path.is_file() and state_path.is_file():
+        try:
+            previous = json.loads(state_path.read_text())
+        except ValueError:
+            previous = {}
+        if (all(previous.get(key) == state[key]
+                for key in ('size', 'validator', 'piece_size'))
+                and part_path.stat().st_size == file_size):
+            state['done'] = previous.get('done', [])
+    done = set(state['done'])
+
+    def save_state():
+        state['done'] = sorted(done)
+        tmp_path = state_path.with_name(state_path.name + '.tmp')
+        tmp_path.write_text(json.dumps(state))
+        tmp_path.replace(state_path)
+
+    if done:
+        progress(sum(min(_PIECE_SIZE, file_size - start) for start in done))
+    else:
+        with open(part_path, 'wb') as fh:
+            fh.truncate(file_size)
+        save_state()
+
+    lock = threading.Lock()
+
+    def download_piece(start):
+        _download_range(url, headers, part_path, start,
+                        min(start + _PIECE_SIZE, file_size), progress, **kwargs)
+        with lock:
+            done.add(start)
+            save_state()
+
+    with ThreadPoolExecutor(connections) as executor:
+        futures = [executor.submit(download_piece, start)
+                   for start in range(0, file_size, _PIECE_SIZE)
+                   if start not in done]
+        try:
+            for future in futures:
+                future.result()
+        finally:
+            # Don't start any remaining pieces if one of them failed
+            for future in futures:
+                future.cancel()
+    state_path.unlink()
+
+
+def _download_stream(response, part_path, md5, progress):
+    """Write the body of a response to a file in order, hashing it as it is
+    written if `md5` is given"""
+    with open(part_path, 'wb') as fh:
+        while True:
+            chunk = response.read(_BLOCK_SIZE)
+            if not chunk:
+                break
+            fh.write(chunk)
+            if md5 is not None:
+                md5.update(chunk)
+            progress(len(chunk))
+
+
+def download(url, checksum=None, as_browser=False, output_path=None,
+             connections=1, **kwargs):
     """Download file from a URL
 
+    If the server supports range requests, the file is downloaded in pieces,
+    optionally over several connections at once. A piece whose connection
+    drops is retried from where it left off, and the pieces already written
+    by an interrupted run are kept, so running the script again resumes the
+    download. Otherwise, the file is streamed to disk in a single request.
+
     Parameters
     ----------
     url : str
@@ -57,6 +1036,9 @@ def download(url, checksum=None, as_browser=False, output_path=None, **kwargs):
         Change User-Agent header to appear as a browser
     output_path : str or Path
         Specifies a location to save the downloaded file
+    connections : int
+        Number of connections to download over in parallel when the server
+        supports range requests
     kwargs : dict
         Keyword arguments passed to :func:`urllib.request.urlopen`
 
@@ -66,42 +1048,90 @@ def download(url, checksum=None, as_browser=False, output_path=None, **kwargs):
         Name of file written locally
 
     """
-    if as_browser:
-        page = Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-    else:
-        page = url
+    headers = {'User-Agent': 'Mozilla/5.0'} if as_browser else {}
+
+    downloaded = 0
+    last_update = 0.
+    lock = threading.Lock()
 
-    with urlopen(page, **kwargs) as response:
-        # Get file size from header
-        file_size = response.length
+    def progress(nbytes):
+        nonlocal downloaded, last_update
+        with lock:
+            downloaded += nbytes
+            # Only redraw the status every so often since writing to the
+            # terminal for every block slows down fast downloads
+            now = time.monotonic()
+            if now - last_update < _PROGRESS_INTERVAL and downloaded != file_size:
+                return
+            last_update = now
+            if file_size:
+                status = '{:10}  [{:3.2f}%]'.format(
+                    downloaded, downloaded * 100. / file_size)
+            else:
+                status = '{:10}'.format(downloaded)
+            print(status + '\b'*len(status), end='', flush=True)
+
+    local_path = Path(Path(urlparse(url).path).name)
+    if output_path is not None:
+        Path(output_path).mkdir(parents=True, exist_ok=True)
+        local_path = output_path / local_path
+
+    # Write to a temporary file that is moved into place once complete so
+    # that an interrupted download is never mistaken for a finished one
+    part_path = local_path.with_name(local_path.name + '.part')
+    md5 = None
+
+    # Only ask for the first byte. A server that supports range requests
+    # replies with the size of the file; any other server sends the whole
+    # file, which is streamed to disk from the same response.
+    request = Request(url, headers=dict(headers, Range='bytes=0-0'))
+    with urlopen(request, **kwargs) as response:
+        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+        ranged = response.status == 206 and total.isdigit()
+        file_size = int(total) if ranged else response.length
+        validator = (response.headers.get('ETag')
+                     or response.headers.get('Last-Modified'))
 
-        local_path = Path(Path(urlparse(url).path).name)
-        if output_path is not None:
-            Path(output_path).mkdir(parents=True, exist_ok=True)
-            local_path = output_path / local_path
         # Check if file already downloaded
         if local_path.is_file():
             if local_path.stat().st_size == file_size:
-                print('Skipping {}, already downloaded'.format(local_path))
-                return local_path
+                if checksum is None or _md5sum(local_path) == checksum:
+                    print('Skipping {}, already downloaded'.format(local_path))
+                    return local_path
+                print('Checksum for {} does not match, downloading '
+                      'again'.format(local_path))
 
-        # Copy file to disk in chunks
         print('Downloading {}... '.format(local_path), end='')
+        streamed = not ranged and response.status == 200
+        if streamed:
+            # When the file is streamed in order, hash it as it is written
+            # rather than reading it back afterwards
+            md5 = hashlib.md5() if checksum is not None else None
+            _download_stream(response, part_path, md5, progress)
+
+    if ranged:
+        try:
+            _download_pieces(url, headers, part_path, file_size, validator,
+                             connections, progress, **kwargs)
+        except _RangeNotSupported:
+            # Some servers, e.g. behind redirects or CDNs, advertise range
+            # support but then send the whole file
+            print('\nServer did not honor range request, downloading '
+                  '{} in a single stream... '.format(local_path), end='')
+            ranged = False
+            state_path = part_path.with_name(part_path.name + '.json')
+            if state_path.exists():
+                state_path.unlink()
+    if not ranged and not streamed:
         downloaded = 0
-        with open(local_path, 'wb') as fh:
-            while True:
-                chunk = response.read(_BLOCK_SIZE)
-                if not chunk:
-                    break
-                fh.write(chunk)
-                downloaded += len(chunk)
-                status = '{:10}  [{:3.2f}%]'.format(
-                    downloaded, downloaded * 100. / file_size)
-                print(status + '\b'*len(status), end='', flush=True)
-            print('')
+        md5 = hashlib.md5() if checksum is not None else None
+        with urlopen(Request(url, headers=headers), **kwargs) as response:
+            file_size = response.length
+            _download_stream(response, part_path, md5, progress)
+    print('')
 
     if checksum is not None:
-        downloadsum = hashlib.md5(open(local_path, 'rb').read()).hexdigest()
+        downloadsum = md5.hexdigest() if md5 is not None else _md5sum(part_path)
         if downloadsum != checksum:
             raise OSError("MD5 checksum for {} does not match. If this is "
                           "your first time receiving this message, please "
@@ -109,4 +1139,5 @@ def download(url, checksum=None, as_browser=False, output_path=None, **kwargs):
                           "OpenMC developers by emailing "
                           "openmc-users@googlegroups.com.".format(local_path))
 
+    part_path.replace(local_path)
     return local_path